@@ -0,0 +1,379 @@
+import os
+import csv
+import sys
+import json
+import argparse
+import itertools
+import contextlib
+from datetime import datetime
+
+import LLM_local_test_temporal_series as runner
+from LLM_local_recursos import MuestreadorRecursos
+
+# Benchmark de latencia del runner de series temporales sobre los datasets de 'dataset/'.
+# Cada configuración (modelo, memory_limit, ventana deslizante, variante de prompt) se reproduce
+# completa y se resumen sus percentiles de latencia, tokens y throughput.
+
+# Variantes de prompt/salida: valores que se asignan a las variables de módulo del runner
+VARIANTES = {
+    "base": {},
+    "sin_razonamiento": {"include_reasoning": False},
+    "texto_libre": {"structured_output": False},
+    "multiturno": {"prompt_layout": "multiturno"},
+    "csv": {"sample_encoding": "csv"},
+    "delta": {"sample_encoding": "delta"},
+    "ventana_adaptativa": {"adaptive_window": True},
+    "ventana_tiempo": {"window_strategy": "tiempo"},
+    "keyframes": {"window_strategy": "tiempo", "window_keyframes": True},
+    "cache": {"response_cache": True},
+}
+
+# Estrategias de ventana comparadas al contar tokens
+ESTRATEGIAS_VENTANA = {
+    "muestras": {},
+    "tiempo": {"window_strategy": "tiempo"},
+    "keyframes": {"window_strategy": "tiempo", "window_keyframes": True},
+}
+
+METRICAS = ("total", "ttft", "tts", "prompt_tokens", "completion_tokens", "cached_tokens", "prefijo_comun", "tokens_s")
+# Recursos del servidor durante cada petición (con --recursos)
+RECURSOS = ("cpu_servidor", "rss_servidor_mb", "hilos_servidor", "cpu_sistema", "carga_1m", "memoria_usada",
+            "swap_usada", "frecuencia_cpu_mhz", "temperatura_c")
+
+def percentil(valores, p):
+    """Percentil con interpolación lineal entre rangos (p en 0-100)."""
+    valores = sorted(v for v in valores if v is not None)
+    if not valores:
+        return None
+    posicion = (len(valores) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(valores) - 1)
+    return valores[inferior] + (valores[superior] - valores[inferior]) * (posicion - inferior)
+
+def tokens_por_segundo(tiempos):
+    # Velocidad de generación: tokens generados entre el primer token y el final
+    if tiempos.get("ttft") is None:
+        return None
+    generacion = (tiempos["total"] or 0) - tiempos["ttft"]
+    if not tiempos.get("completion_tokens") or generacion <= 0:
+        return None
+    return tiempos["completion_tokens"] / generacion
+
+@contextlib.contextmanager
+def configuracion_runner(valores):
+    """Asigna temporalmente variables de módulo del runner y las restaura al salir."""
+    anteriores = {clave: getattr(runner, clave) for clave in valores}
+    for clave, valor in valores.items():
+        setattr(runner, clave, valor)
+    try:
+        yield
+    finally:
+        for clave, valor in anteriores.items():
+            setattr(runner, clave, valor)
+
+def ejecutar_configuracion(modelo, dataset, mensajes, memory_limit, ventana, variante, silencioso=True, concurrencia=1,
+                           intervalo_recursos=None):
+    if concurrencia > 1 and runner.cassette_mode != "directo":
+        # La reproducción concurrente usa AsyncOpenAI directamente y no pasa por el cassette
+        raise ValueError("El cassette no admite la reproducción concurrente (--concurrencia > 1)")
+    valores = {"memory_limit": memory_limit, "memory_sliding_window_size": ventana, **VARIANTES[variante]}
+    muestreador = MuestreadorRecursos(intervalo_recursos).iniciar() if intervalo_recursos else None
+    with configuracion_runner(valores):
+        salida = open(os.devnull, "w") if silencioso else None
+        try:
+            with contextlib.redirect_stdout(salida) if silencioso else contextlib.nullcontext():
+                if concurrencia > 1:
+                    resultados, estadisticas = runner.evaluar_offline_concurrente(modelo, mensajes, concurrencia)
+                else:
+                    runner.chat_local(modelo, mensajes)
+        finally:
+            if salida:
+                salida.close()
+            if muestreador:
+                muestreador.parar()
+        if concurrencia > 1:
+            # Sin streaming no hay TTFT ni tiempo hasta el TTS
+            campos = ("idx", "inicio", "total", "prompt_tokens", "completion_tokens", "decision")
+            peticiones = [{campo: r.get(campo) for campo in campos} for r in resultados if r["reply"] is not None]
+        else:
+            peticiones = [dict(t, tokens_s=tokens_por_segundo(t)) for t in runner.expended_times]
+            estadisticas = dict(runner.estadisticas_ejecucion)
+    if muestreador:
+        cruzadas = 0
+        for peticion in peticiones:
+            recursos = muestreador.entre(peticion["inicio"], peticion["inicio"] + peticion["total"]) if peticion.get("inicio") else {}
+            cruzadas += bool(recursos)
+            peticion.update({clave: recursos.get(clave) for clave in RECURSOS})
+        if peticiones and cruzadas < len(peticiones):
+            print(f"⚠️ Recursos: solo {cruzadas} de {len(peticiones)} peticiones tienen muestras de recursos "
+                  f"({len(muestreador.muestras)} muestras tomadas)")
+    return {
+        "modelo": modelo,
+        "dataset": os.path.basename(dataset),
+        "memory_limit": memory_limit,
+        "ventana": ventana,
+        "variante": variante,
+        "peticiones": peticiones,
+        "estadisticas": estadisticas,
+        "recursos": muestreador.muestras if muestreador else None,
+    }
+
+def resumir(resultado):
+    fila = {clave: resultado[clave] for clave in ("modelo", "dataset", "memory_limit", "ventana", "variante")}
+    fila["n"] = len(resultado["peticiones"])
+    for metrica in METRICAS:
+        valores = [p.get(metrica) for p in resultado["peticiones"]]
+        for p in (50, 95, 99):
+            fila[f"{metrica}_p{p}"] = percentil(valores, p)
+    if resultado.get("recursos") is not None:
+        for clave in RECURSOS:
+            valores = [p.get(clave) for p in resultado["peticiones"]]
+            fila[f"{clave}_p50"] = percentil(valores, 50)
+            fila[f"{clave}_max"] = percentil(valores, 100)
+    fila.update({f"stats_{clave}": valor for clave, valor in resultado["estadisticas"].items()})
+    return fila
+
+def correlacion(xs, ys):
+    pares = [(x, y) for x, y in zip(xs, ys) if x is not None and y is not None]
+    if len(pares) < 3:
+        return None
+    mx = sum(x for x, _ in pares) / len(pares)
+    my = sum(y for _, y in pares) / len(pares)
+    cov = sum((x - mx) * (y - my) for x, y in pares)
+    vx = sum((x - mx) ** 2 for x, _ in pares)
+    vy = sum((y - my) ** 2 for _, y in pares)
+    return cov / (vx * vy) ** 0.5 if vx and vy else None
+
+def correlacion_recursos(resultados):
+    """Correlación entre la latencia total de cada petición y los recursos medidos durante ella."""
+    peticiones = [p for r in resultados for p in r["peticiones"]]
+    latencias = [p.get("total") for p in peticiones]
+    print("\n🖥️ Correlación latencia total ↔ recursos durante la petición:")
+    for clave in RECURSOS:
+        r = correlacion(latencias, [p.get(clave) for p in peticiones])
+        if r is not None:
+            print(f"   {clave:<20} {r:+.2f}")
+
+def clave_configuracion(fila):
+    return (fila["modelo"], fila["dataset"], fila["memory_limit"], fila["ventana"], fila["variante"])
+
+def comparar_con_baseline(filas, ruta_baseline, umbral=0.10):
+    """Imprime la variación de p50/p95 frente a un benchmark previo y marca regresiones."""
+    with open(ruta_baseline, "r", encoding="utf-8") as f:
+        baseline = {clave_configuracion(fila): fila for fila in json.load(f)["resumen"]}
+    print(f"\n📏 Comparación con baseline {os.path.basename(ruta_baseline)} (umbral {umbral:.0%}):")
+    regresiones = 0
+    for fila in filas:
+        base = baseline.get(clave_configuracion(fila))
+        if base is None:
+            print(f"   {clave_configuracion(fila)}: sin referencia")
+            continue
+        partes = []
+        for metrica in ("total_p50", "total_p95", "ttft_p50", "ttft_p95"):
+            actual, anterior = fila.get(metrica), base.get(metrica)
+            if not actual or not anterior:
+                continue
+            cambio = actual / anterior - 1
+            marca = "❌" if cambio > umbral else ("✅" if cambio < -umbral else "")
+            regresiones += cambio > umbral
+            partes.append(f"{metrica} {anterior:.2f}→{actual:.2f}s ({cambio:+.0%}){marca}")
+        print(f"   {clave_configuracion(fila)}: " + ", ".join(partes))
+    return regresiones
+
+def concordancia_decisiones(resultados, referencia="base"):
+    """Compara, muestra a muestra, si cada variante decide hablar o callar igual que la variante de referencia."""
+    grupos = {}
+    for resultado in resultados:
+        clave = (resultado["modelo"], resultado["dataset"], resultado["memory_limit"], resultado["ventana"])
+        grupos.setdefault(clave, {})[resultado["variante"]] = {
+            p["idx"]: p["decision"] for p in resultado["peticiones"] if p.get("decision") is not None
+        }
+    concordancias = []
+    for clave, variantes in grupos.items():
+        if referencia not in variantes:
+            continue
+        base = variantes[referencia]
+        for variante, decisiones in variantes.items():
+            if variante == referencia:
+                continue
+            comunes = [idx for idx in decisiones if idx in base]
+            iguales = sum(decisiones[idx] == base[idx] for idx in comunes)
+            concordancia = iguales / len(comunes) if comunes else None
+            concordancias.append({"configuracion": clave, "variante": variante, "muestras": len(comunes), "concordancia": concordancia})
+            texto = f"{concordancia:.0%}" if concordancia is not None else "n/d"
+            print(f"🤝 {clave} {variante} vs {referencia}: {texto} de {len(comunes)} decisiones iguales")
+    return concordancias
+
+def contar_tokens(texto):
+    """Tokens del texto con tiktoken si está instalado; si no, aproximación de ~4 caracteres por token."""
+    global _codificador_tokens
+    if _codificador_tokens is None:
+        try:
+            import tiktoken
+            _codificador_tokens = tiktoken.get_encoding("cl100k_base").encode
+        except ImportError:
+            _codificador_tokens = False
+    if _codificador_tokens:
+        return len(_codificador_tokens(texto))
+    return max(1, len(texto) // 4)
+
+_codificador_tokens = None
+
+def tokens_por_codificacion(datasets, memory_limit):
+    """Tokens medios del mensaje de usuario por petición para cada codificación de muestras (sin modelo)."""
+    print(f"\n🔢 Tokens del mensaje de usuario por petición (ventana de {memory_limit} muestras):")
+    filas = []
+    for dataset in datasets:
+        mensajes = runner.cargar_json(dataset)
+        if not mensajes:
+            continue
+        medias = {}
+        for codificacion, codificador in runner.CODIFICADORES.items():
+            completas, incrementales = runner.tabla_codificada(mensajes, codificacion)
+            ventana = runner.VentanaTemporal(memory_limit, codificador.cabecera)
+            tokens = []
+            for completa, incremental in zip(completas, incrementales):
+                ventana.agregar(incremental, completa)
+                tokens.append(contar_tokens(ventana.prompt()))
+            medias[codificacion] = sum(tokens) / len(tokens)
+        for codificacion, media in medias.items():
+            ahorro = 1 - media / medias["verboso"]
+            filas.append({"dataset": os.path.basename(dataset), "codificacion": codificacion, "tokens_medios": media, "ahorro": ahorro})
+            print(f"   {os.path.basename(dataset)[:34]:<34} {codificacion:<8} {media:8.1f} tokens (ahorro del {ahorro:.0%} frente a verboso)")
+    return filas
+
+def tokens_por_ventana(datasets, memory_limit):
+    """Tokens medios del mensaje de usuario por petición para cada estrategia de ventana (sin modelo)."""
+    print(f"\n🔢 Tokens por estrategia de ventana ({memory_limit} muestras / {runner.window_seconds:g}s):")
+    filas = []
+    for dataset in datasets:
+        mensajes = runner.cargar_json(dataset)
+        if not mensajes:
+            continue
+        completas, incrementales = runner.tabla_codificada(mensajes, runner.sample_encoding)
+        medias = {}
+        for estrategia, valores in ESTRATEGIAS_VENTANA.items():
+            with configuracion_runner({"memory_limit": memory_limit, "adaptive_window": False, **valores}):
+                ventana = runner.crear_ventana()
+                tokens = []
+                for idx, msg in enumerate(mensajes):
+                    ventana.agregar(incrementales[idx], completas[idx], msg, idx)
+                    tokens.append(contar_tokens(ventana.prompt()))
+            medias[estrategia] = (sum(tokens) / len(tokens), getattr(ventana, "descartadas_keyframe", 0))
+        for estrategia, (media, descartadas) in medias.items():
+            ahorro = 1 - media / medias["muestras"][0]
+            filas.append({"dataset": os.path.basename(dataset), "estrategia": estrategia, "tokens_medios": media,
+                          "ahorro": ahorro, "descartadas_keyframe": descartadas})
+            print(f"   {os.path.basename(dataset)[:34]:<34} {estrategia:<10} {media:8.1f} tokens "
+                  f"(ahorro del {ahorro:.0%} frente a muestras, {descartadas} muestras descartadas)")
+    return filas
+
+def guardar_resultados(resultados, filas, carpeta, extra=None):
+    os.makedirs(carpeta, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    ruta_json = os.path.join(carpeta, f"benchmark_{timestamp}.json")
+    ruta_csv = os.path.join(carpeta, f"benchmark_{timestamp}.csv")
+    with open(ruta_json, "w", encoding="utf-8") as f:
+        json.dump({"resumen": filas, "resultados": resultados, **(extra or {})}, f, ensure_ascii=False, indent=2)
+    with open(ruta_csv, "w", encoding="utf-8", newline="") as f:
+        escritor = csv.DictWriter(f, fieldnames=list(filas[0]))
+        escritor.writeheader()
+        escritor.writerows(filas)
+    print(f"💾 Resultados guardados en: {ruta_json} y {ruta_csv}")
+    return ruta_json, ruta_csv
+
+def imprimir_tabla(filas):
+    print(f"\n{'modelo':<28} {'dataset':<34} {'mem':>3} {'vent':>4} {'variante':<16} {'n':>4} "
+          f"{'p50':>6} {'p95':>6} {'p99':>6} {'ttft50':>6} {'tok/s':>6}")
+    for fila in filas:
+        def f(valor):
+            return f"{valor:6.2f}" if valor is not None else f"{'-':>6}"
+        print(f"{fila['modelo'][:28]:<28} {fila['dataset'][:34]:<34} {fila['memory_limit']:>3} {fila['ventana']:>4} "
+              f"{fila['variante'][:16]:<16} {fila['n']:>4} {f(fila['total_p50'])} {f(fila['total_p95'])} "
+              f"{f(fila['total_p99'])} {f(fila['ttft_p50'])} {f(fila['tokens_s_p50'])}")
+
+if __name__ == "__main__":
+    import LLM_local_mock_server as mock
+    parser = argparse.ArgumentParser(description="Benchmark de latencia del runner de series temporales")
+    parser.add_argument("--modelos", nargs="+", help="modelos a evaluar (por defecto, el cargado en LM Studio)")
+    parser.add_argument("--datasets", nargs="+", help="ficheros de dataset (por defecto, todos los de 'dataset/')")
+    parser.add_argument("--memory-limits", nargs="+", type=int, default=[runner.memory_limit])
+    parser.add_argument("--ventanas", nargs="+", type=int, default=[runner.memory_sliding_window_size],
+                        help="valores de memory_sliding_window_size")
+    parser.add_argument("--variantes", nargs="+", choices=sorted(VARIANTES), default=["base"])
+    parser.add_argument("--api", help="URL base de la API (p. ej. http://localhost:3000/v1)")
+    parser.add_argument("--mock", choices=sorted(mock.PERFILES),
+                        help="arranca el servidor mock en proceso con este perfil de latencia")
+    parser.add_argument("--baseline", help="JSON de un benchmark anterior con el que comparar")
+    parser.add_argument("--umbral", type=float, default=0.10, help="variación relativa considerada regresión")
+    parser.add_argument("--salida", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+    parser.add_argument("--verbose", action="store_true", help="muestra la salida del runner")
+    parser.add_argument("--concurrencia", type=int, default=1,
+                        help="peticiones simultáneas en la reproducción offline (1: runner secuencial)")
+    parser.add_argument("--contar-tokens", action="store_true",
+                        help="solo cuenta los tokens de cada codificación y estrategia de ventana, sin llamar al modelo")
+    parser.add_argument("--cassette", choices=("directo", "grabar", "reproducir"), default="directo",
+                        help="graba las respuestas en SQLite o las reproduce sin llamar al modelo")
+    parser.add_argument("--cassette-ruta", help="fichero SQLite del cassette (por defecto, cassettes/cassette.sqlite)")
+    parser.add_argument("--simular-tiempos", action="store_true",
+                        help="al reproducir el cassette, espera los tiempos grabados")
+    parser.add_argument("--recursos", type=float, nargs="?", const=0.5,
+                        help="muestrea CPU/RSS/hilos de LM Studio y la carga del sistema cada N segundos (0.5 por defecto)")
+    args = parser.parse_args()
+    if args.cassette != "directo" and args.concurrencia > 1:
+        parser.error("--cassette grabar/reproducir no admite --concurrencia > 1: las peticiones concurrentes no pasan por el cassette")
+
+    if args.contar_tokens:
+        datasets = args.datasets or sorted(runner.listar_json_dataset())
+        tokens_por_codificacion(datasets, args.memory_limits[0])
+        tokens_por_ventana(datasets, args.memory_limits[0])
+        sys.exit(0)
+
+    servidor_mock = None
+    if args.mock:
+        servidor_mock = mock.iniciar_servidor_mock(puerto=0, config=mock.ConfigMock(perfil=args.mock))
+        args.api = f"http://127.0.0.1:{servidor_mock.server_address[1]}/v1"
+        args.modelos = args.modelos or [mock.MODELO_MOCK]
+    if args.api:
+        runner.LMSTUDIO_API_URL = args.api
+    runner.cassette_mode = args.cassette
+    runner.cassette_path = args.cassette_ruta
+    runner.cassette_simulate_timing = args.simular_tiempos
+
+    # Al reproducir un cassette no hace falta servidor
+    if args.cassette != "reproducir" and not runner.esperar_api():
+        print("⚠️ No se pudo verificar la disponibilidad del servidor.")
+        sys.exit(1)
+    modelos = args.modelos or [runner.obtener_modelo_lanzado_lmstudio() or runner.model_name]
+    datasets = args.datasets or sorted(runner.listar_json_dataset())
+
+    resultados = []
+    filas = []
+    # Cada dataset se carga una sola vez: la misma lista permite reutilizar sus tablas codificadas en el runner
+    cargados = {}
+    configuraciones = list(itertools.product(modelos, datasets, args.memory_limits, args.ventanas, args.variantes))
+    for i, (modelo, dataset, memory_limit, ventana, variante) in enumerate(configuraciones):
+        print(f"▶️ [{i+1}/{len(configuraciones)}] {modelo} | {os.path.basename(dataset)} | "
+              f"memory_limit={memory_limit} | ventana={ventana} | {variante}")
+        if dataset not in cargados:
+            cargados[dataset] = runner.cargar_json(dataset)
+        mensajes = cargados[dataset]
+        if not mensajes:
+            continue
+        resultado = ejecutar_configuracion(modelo, dataset, mensajes, memory_limit, ventana, variante,
+                                           silencioso=not args.verbose, concurrencia=args.concurrencia,
+                                           intervalo_recursos=args.recursos)
+        resultados.append(resultado)
+        filas.append(resumir(resultado))
+
+    if filas:
+        imprimir_tabla(filas)
+        guardar_resultados(resultados, filas, args.salida)
+        if len(args.variantes) > 1:
+            concordancia_decisiones(resultados, args.variantes[0])
+        if args.recursos:
+            correlacion_recursos(resultados)
+        if args.baseline:
+            comparar_con_baseline(filas, args.baseline, args.umbral)
+    if servidor_mock:
+        servidor_mock.shutdown()
@@ -0,0 +1,193 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from types import SimpleNamespace
+
+# Grabación y reproducción de respuestas del modelo en SQLite ("cassette").
+# En modo "grabar" cada petición va al modelo y se guarda su respuesta con sus tiempos; en "reproducir"
+# se responde desde el disco sin llamar al modelo; "directo" no toca el cassette.
+# La clave es el hash del modelo, los mensajes y los parámetros de muestreo (no el modo streaming),
+# así que una grabación en streaming sirve para reproducir sin streaming y al revés.
+
+MODOS = ("directo", "grabar", "reproducir")
+PARAMETROS_CLAVE = ("model", "messages", "temperature", "top_p", "max_tokens", "response_format", "seed", "stop")
+
+def ruta_cassette_por_defecto():
+    carpeta = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes")
+    os.makedirs(carpeta, exist_ok=True)
+    return os.path.join(carpeta, "cassette.sqlite")
+
+def clave_peticion(kwargs):
+    datos = {parametro: kwargs[parametro] for parametro in PARAMETROS_CLAVE if parametro in kwargs}
+    texto = json.dumps(datos, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+class PeticionNoGrabada(LookupError):
+    pass
+
+class _Completions:
+    def __init__(self, cassette):
+        self._cassette = cassette
+
+    def create(self, **kwargs):
+        return self._cassette.crear_completion(**kwargs)
+
+class _Chat:
+    def __init__(self, cassette):
+        self.completions = _Completions(cassette)
+
+class Cassette:
+    def __init__(self, client, ruta=None, modo="grabar", simular_tiempos=False):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de cassette desconocido: {modo!r} (válidos: {', '.join(MODOS)})")
+        self.client = client
+        self.ruta = ruta or ruta_cassette_por_defecto()
+        self.modo = modo
+        self.simular_tiempos = simular_tiempos
+        self.grabadas = 0
+        self.reproducidas = 0
+        self.no_encontradas = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.ruta, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas ("
+            "clave TEXT PRIMARY KEY, modelo TEXT, contenido TEXT, prompt_tokens INTEGER, "
+            "completion_tokens INTEGER, ttft REAL, total REAL, creado REAL)"
+        )
+        self._db.commit()
+        # Misma interfaz que OpenAI: cassette.chat.completions.create(...)
+        self.chat = _Chat(self)
+
+    def __getattr__(self, nombre):
+        # El resto de atributos (endpoints, resumen del pool...) son los del cliente envuelto
+        if nombre == "client":
+            raise AttributeError(nombre)
+        return getattr(self.client, nombre)
+
+    def buscar(self, clave):
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT contenido, prompt_tokens, completion_tokens, ttft, total FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+        if fila is None:
+            return None
+        return dict(zip(("contenido", "prompt_tokens", "completion_tokens", "ttft", "total"), fila))
+
+    def guardar(self, clave, modelo, contenido, prompt_tokens, completion_tokens, ttft, total):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (clave, modelo, contenido, prompt_tokens, completion_tokens, ttft, total, time.time()),
+            )
+            self._db.commit()
+            self.grabadas += 1
+
+    def crear_completion(self, **kwargs):
+        if self.modo == "directo":
+            return self.client.chat.completions.create(**kwargs)
+        clave = clave_peticion(kwargs)
+        if self.modo == "reproducir":
+            registro = self.buscar(clave)
+            if registro is None:
+                self.no_encontradas += 1
+                raise PeticionNoGrabada(f"Petición no grabada en {self.ruta} ({clave[:12]})")
+            self.reproducidas += 1
+            if kwargs.get("stream"):
+                return self._reproducir_stream(registro, kwargs)
+            if self.simular_tiempos and registro["total"]:
+                time.sleep(registro["total"])
+            return SimpleNamespace(
+                choices=[SimpleNamespace(index=0, message=SimpleNamespace(role="assistant", content=registro["contenido"]),
+                                         finish_reason="stop")],
+                usage=self._usage(registro),
+            )
+        inicio = time.monotonic()
+        respuesta = self.client.chat.completions.create(**kwargs)
+        if kwargs.get("stream"):
+            return self._grabar_stream(respuesta, clave, kwargs.get("model"), inicio)
+        total = time.monotonic() - inicio
+        usage = respuesta.usage
+        self.guardar(
+            clave, kwargs.get("model"), respuesta.choices[0].message.content,
+            usage.prompt_tokens if usage else None, usage.completion_tokens if usage else None, None, total,
+        )
+        return respuesta
+
+    def _grabar_stream(self, stream, clave, modelo, inicio):
+        partes = []
+        ttft = None
+        usage = None
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if ttft is None:
+                    ttft = time.monotonic() - inicio
+                partes.append(chunk.choices[0].delta.content)
+            yield chunk
+        # Solo se graban las respuestas completas (no las canceladas a medias)
+        self.guardar(
+            clave, modelo, "".join(partes), usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None, ttft, time.monotonic() - inicio,
+        )
+
+    def _reproducir_stream(self, registro, kwargs):
+        trozos = re.findall(r"\S+\s*|\s+", registro["contenido"] or "")
+        espera_primero = (registro["ttft"] or 0.0) if self.simular_tiempos else 0.0
+        espera_token = 0.0
+        if self.simular_tiempos and registro["total"] and len(trozos) > 1:
+            espera_token = max(registro["total"] - espera_primero, 0.0) / (len(trozos) - 1)
+        if espera_primero:
+            time.sleep(espera_primero)
+        for i, trozo in enumerate(trozos):
+            if i and espera_token:
+                time.sleep(espera_token)
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=trozo), finish_reason=None)], usage=None
+            )
+        yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=None), finish_reason="stop")],
+                              usage=None)
+        if (kwargs.get("stream_options") or {}).get("include_usage"):
+            yield SimpleNamespace(choices=[], usage=self._usage(registro))
+
+    @staticmethod
+    def _usage(registro):
+        return SimpleNamespace(
+            prompt_tokens=registro["prompt_tokens"], completion_tokens=registro["completion_tokens"],
+            total_tokens=(registro["prompt_tokens"] or 0) + (registro["completion_tokens"] or 0),
+            prompt_tokens_details=None,
+        )
+
+    def resumen(self):
+        print(
+            f"📼 Cassette ({self.modo}) {self.ruta}: {self.grabadas} grabadas, {self.reproducidas} reproducidas, "
+            f"{self.no_encontradas} no encontradas"
+        )
+
+    def cerrar(self):
+        with self._lock:
+            self._db.close()
+
+def envolver(client, modo="directo", ruta=None, simular_tiempos=False):
+    """Devuelve el cliente tal cual en modo "directo" o envuelto en un Cassette en los demás."""
+    if modo == "directo":
+        return client
+    return Cassette(client, ruta, modo, simular_tiempos)
+
+if __name__ == "__main__":
+    ruta = sys.argv[1] if len(sys.argv) > 1 else ruta_cassette_por_defecto()
+    if not os.path.exists(ruta):
+        print(f"❌ No existe el cassette: {ruta}")
+        sys.exit(1)
+    with sqlite3.connect(ruta) as db:
+        filas = db.execute(
+            "SELECT modelo, COUNT(*), AVG(total), AVG(ttft) FROM respuestas GROUP BY modelo ORDER BY modelo"
+        ).fetchall()
+    print(f"📼 {ruta}")
+    for modelo, n, total, ttft in filas:
+        print(f"   {modelo}: {n} respuestas, total medio {total or 0:.2f}s, primer token medio {ttft or 0:.2f}s")
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import bisect
+import codecs
+import argparse
+
+# Carga de datasets de muestras, compartida por todos los scripts.
+# Dos formatos: el de siempre, {"messages": [muestra, ...]}, y JSONL (una muestra por línea).
+# iterar_muestras() los lee de forma incremental con memoria constante, y con un índice lateral
+# (<fichero>.idx.json: 'time_mission_start' → posición en bytes) puede empezar en cualquier instante.
+
+TAM_BLOQUE = 1 << 16
+PASO_INDICE = 256
+
+def listar_json_dataset():
+    """Lista los archivos .json y .jsonl dentro de la carpeta 'dataset' en el mismo directorio del script."""
+    dataset_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset")
+    if not os.path.exists(dataset_dir):
+        print(f"❌ No existe la carpeta: {dataset_dir}")
+        return []
+    archivos_json = [
+        f for f in os.listdir(dataset_dir) if f.endswith((".json", ".jsonl")) and not f.endswith(".idx.json")
+    ]
+    return [os.path.join(dataset_dir, f) for f in archivos_json]
+
+def seleccionar_json():
+    """Permite seleccionar un archivo JSON de la carpeta dataset."""
+    archivos = listar_json_dataset()
+    if not archivos:
+        print("⚠️ No se encontraron archivos .json en la carpeta 'dataset'.")
+        return None
+    print("\n📂 Archivos JSON disponibles en 'dataset':")
+    for i, archivo in enumerate(archivos):
+        print(f"{i+1}. {os.path.basename(archivo)}")
+    while True:
+        try:
+            eleccion = int(input("\nElige un archivo (número, 0 para cancelar): "))
+            if eleccion == 0:
+                return None
+            if 1 <= eleccion <= len(archivos):
+                return archivos[eleccion - 1]
+            else:
+                print("❗ Opción fuera de rango.")
+        except ValueError:
+            print("❗ Introduce un número válido.")
+
+def cargar_json(ruta_json):
+    """Carga todas las muestras en una lista (datasets pequeños). Para grabaciones largas, iterar_muestras."""
+    try:
+        return list(iterar_muestras(ruta_json))
+    except Exception as e:
+        print(f"❌ Error al leer el JSON: {e}")
+        return []
+
+def es_jsonl(ruta):
+    return ruta.endswith(".jsonl")
+
+# Lector incremental del formato {"messages": [...]}: decodifica objeto a objeto sobre un búfer acotado
+class _LectorMensajes:
+    def __init__(self, f, posicion=0):
+        f.seek(posicion)
+        self.f = f
+        self.posicion = posicion  # posición en bytes de buf[i]
+        self.buf = ""
+        self.i = 0
+        self.fin = False
+        self._decodificador = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+
+    def _rellenar(self):
+        datos = self.f.read(TAM_BLOQUE)
+        if not datos:
+            self.fin = True
+            return False
+        # Se descarta lo ya consumido: el búfer nunca pasa de un bloque más la muestra en curso
+        self.buf = self.buf[self.i:] + self._decodificador.decode(datos)
+        self.i = 0
+        return True
+
+    def _consumir(self, n):
+        self.posicion += len(self.buf[self.i:self.i + n].encode("utf-8"))
+        self.i += n
+
+    def siguiente_caracter(self):
+        """Salta espacios y devuelve el siguiente carácter significativo (None al final del fichero)."""
+        while True:
+            while self.i < len(self.buf) and self.buf[self.i] in " \t\r\n":
+                self.i += 1
+                self.posicion += 1
+            if self.i < len(self.buf):
+                return self.buf[self.i]
+            if not self._rellenar():
+                return None
+
+    def esperar(self, caracter):
+        if self.siguiente_caracter() != caracter:
+            raise ValueError(f"Se esperaba '{caracter}' en el byte {self.posicion}")
+        self._consumir(1)
+
+    def valor(self):
+        self.siguiente_caracter()
+        while True:
+            try:
+                valor, fin = self._json.raw_decode(self.buf, self.i)
+                # Un número al final del búfer puede estar cortado: se lee más antes de darlo por bueno
+                if fin < len(self.buf) or self.fin or not self._rellenar():
+                    self._consumir(fin - self.i)
+                    return valor
+            except json.JSONDecodeError:
+                if not self._rellenar():
+                    raise ValueError(f"JSON incompleto a partir del byte {self.posicion}")
+
+    def abrir_lista(self):
+        """Avanza hasta el inicio de la lista 'messages' del objeto raíz."""
+        self.esperar("{")
+        while True:
+            clave = self.valor()
+            self.esperar(":")
+            if clave == "messages":
+                self.esperar("[")
+                return
+            self.valor()
+            if self.siguiente_caracter() != ",":
+                raise ValueError("El JSON no contiene la clave 'messages' con una lista.")
+            self._consumir(1)
+
+    def elementos(self):
+        """Itera los elementos de la lista desde la posición actual: (posición en bytes, muestra)."""
+        primero = True
+        while True:
+            caracter = self.siguiente_caracter()
+            if caracter == "]":
+                return
+            if caracter is None:
+                raise ValueError("Lista 'messages' sin cerrar")
+            if caracter == ",":
+                self._consumir(1)
+                self.siguiente_caracter()
+            elif not primero:
+                raise ValueError(f"Se esperaba ',' en el byte {self.posicion}")
+            primero = False
+            yield self.posicion, self.valor()
+
+def _iterar_posiciones(ruta, posicion=None):
+    """(posición en bytes, muestra) de cada muestra, desde el principio o desde una posición del índice."""
+    with open(ruta, "rb") as f:
+        if es_jsonl(ruta):
+            f.seek(posicion or 0)
+            while True:
+                inicio = f.tell()
+                linea = f.readline()
+                if not linea:
+                    return
+                if linea.strip():
+                    yield inicio, json.loads(linea)
+            return
+        lector = _LectorMensajes(f, posicion or 0)
+        if posicion is None:
+            lector.abrir_lista()
+        yield from lector.elementos()
+
+def ruta_indice(ruta):
+    return ruta + ".idx.json"
+
+def construir_indice(ruta, paso=PASO_INDICE):
+    """Recorre el fichero una vez y guarda (time_mission_start, posición) de una de cada 'paso' muestras."""
+    entradas = []
+    total = 0
+    for i, (posicion, msg) in enumerate(_iterar_posiciones(ruta)):
+        if i % paso == 0:
+            entradas.append((msg["time_mission_start"], posicion))
+        total = i + 1
+    estado = os.stat(ruta)
+    indice = {"tamaño": estado.st_size, "mtime": estado.st_mtime, "muestras": total, "paso": paso, "entradas": entradas}
+    with open(ruta_indice(ruta), "w", encoding="utf-8") as f:
+        json.dump(indice, f)
+    return indice
+
+def cargar_indice(ruta):
+    """Índice lateral del fichero; se reconstruye si no existe o si el fichero ha cambiado."""
+    estado = os.stat(ruta)
+    try:
+        with open(ruta_indice(ruta), "r", encoding="utf-8") as f:
+            indice = json.load(f)
+        if indice["tamaño"] == estado.st_size and indice["mtime"] == estado.st_mtime:
+            return indice
+    except (OSError, ValueError, KeyError):
+        pass
+    return construir_indice(ruta)
+
+def iterar_muestras(ruta, desde=None):
+    """Itera las muestras sin cargar el fichero entero. Con 'desde' (segundos de time_mission_start)
+    salta con el índice lateral hasta la primera muestra en o después de ese instante."""
+    posicion = None
+    if desde is not None:
+        entradas = cargar_indice(ruta)["entradas"]
+        i = bisect.bisect_right([t for t, _ in entradas], desde) - 1
+        if i >= 0:
+            posicion = entradas[i][1]
+    for _, msg in _iterar_posiciones(ruta, posicion):
+        if desde is not None and msg["time_mission_start"] < desde:
+            continue
+        yield msg
+
+def convertir(origen, destino):
+    """Convierte entre {"messages": [...]} y JSONL según la extensión del destino, muestra a muestra."""
+    with open(destino, "w", encoding="utf-8") as f:
+        if es_jsonl(destino):
+            for msg in iterar_muestras(origen):
+                f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+        else:
+            f.write('{"messages": [')
+            for i, msg in enumerate(iterar_muestras(origen)):
+                f.write(("," if i else "") + "\n  " + json.dumps(msg, ensure_ascii=False))
+            f.write("\n]}\n")
+    print(f"💾 Dataset convertido en: {destino}")
+    return destino
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Utilidades de datasets de muestras (.json / .jsonl)")
+    subparsers = parser.add_subparsers(dest="orden", required=True)
+    p_convertir = subparsers.add_parser("convertir", help="convierte entre {'messages': [...]} y JSONL")
+    p_convertir.add_argument("origen")
+    p_convertir.add_argument("destino")
+    p_indice = subparsers.add_parser("indice", help="construye el índice lateral por time_mission_start")
+    p_indice.add_argument("ruta")
+    p_indice.add_argument("--paso", type=int, default=PASO_INDICE)
+    args = parser.parse_args()
+
+    if args.orden == "convertir":
+        convertir(args.origen, args.destino)
+    else:
+        indice = construir_indice(args.ruta, args.paso)
+        print(f"🗂️ Índice de {indice['muestras']} muestras ({len(indice['entradas'])} entradas) en {ruta_indice(args.ruta)}")
+    sys.exit(0)
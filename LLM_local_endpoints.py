@@ -0,0 +1,161 @@
+import time
+import threading
+from openai import OpenAI, Timeout, APIConnectionError, APITimeoutError, APIStatusError
+
+# Pool de servidores compatibles con la API de LM Studio.
+# Cada petición va al endpoint sano con menor latencia reciente y menos peticiones en curso;
+# si falla (conexión, timeout o error 5xx) se reintenta en el siguiente.
+# El timeout de conexión es corto para pasar pronto a otro servidor si uno está caído; el de lectura es
+# amplio porque una inferencia en CPU con un prompt largo puede tardar minutos.
+
+class Endpoint:
+    def __init__(self, url, timeout=600.0, timeout_conexion=5.0, reintentos=0):
+        self.url = url
+        # Un cliente por endpoint durante toda la ejecución: reutiliza las conexiones (keep-alive)
+        self.client = OpenAI(base_url=url, api_key="lm-studio", timeout=Timeout(timeout, connect=timeout_conexion),
+                             max_retries=reintentos)
+        self.sano = True
+        self.latencia = None
+        self.en_vuelo = 0
+        self.peticiones = 0
+        self.fallos = 0
+        self.ultimo_fallo = 0.0
+
+    def puntuacion(self):
+        # Latencia media reciente escalada por la cola; los endpoints sin medidas se prueban primero
+        return (self.latencia or 0.0) * (1 + self.en_vuelo)
+
+    def registrar_exito(self, duracion, alfa=0.3):
+        self.sano = True
+        self.peticiones += 1
+        self.latencia = duracion if self.latencia is None else alfa * duracion + (1 - alfa) * self.latencia
+
+    def registrar_fallo(self):
+        self.sano = False
+        self.fallos += 1
+        self.ultimo_fallo = time.monotonic()
+
+class _StreamMedido:
+    """Envuelve un stream de un endpoint: la petición sigue en curso hasta que se agota o se cierra el stream.
+    Al terminar registra la latencia total; si falla a mitad, marca el endpoint como caído."""
+
+    def __init__(self, pool, endpoint, stream, inicio):
+        self._pool = pool
+        self._endpoint = endpoint
+        self._stream = stream
+        self._inicio = inicio
+        self._liberado = False
+
+    def __getattr__(self, nombre):
+        return getattr(self._stream, nombre)
+
+    def _liberar(self):
+        if not self._liberado:
+            self._liberado = True
+            with self._pool._lock:
+                self._endpoint.en_vuelo -= 1
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                yield chunk
+        except GeneratorExit:
+            raise
+        except Exception:
+            self._endpoint.registrar_fallo()
+            raise
+        else:
+            self._endpoint.registrar_exito(time.monotonic() - self._inicio)
+        finally:
+            self._liberar()
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._liberar()
+
+class _Completions:
+    def __init__(self, pool):
+        self._pool = pool
+
+    def create(self, **kwargs):
+        return self._pool.crear_completion(**kwargs)
+
+class _Chat:
+    def __init__(self, pool):
+        self.completions = _Completions(pool)
+
+class PoolEndpoints:
+    def __init__(self, urls, timeout=600.0, timeout_conexion=5.0, reintentos=None, reintento_caidos=10.0):
+        # Con varios servidores el reintento es pasar al siguiente; con uno solo, los reintentos del cliente
+        # (2, como el cliente de OpenAI por defecto)
+        if reintentos is None:
+            reintentos = 2 if len(urls) == 1 else 0
+        self.endpoints = [Endpoint(url, timeout, timeout_conexion, reintentos) for url in urls]
+        self.reintento_caidos = reintento_caidos
+        self._lock = threading.Lock()
+        # Misma interfaz que OpenAI para las llamadas existentes: pool.chat.completions.create(...)
+        self.chat = _Chat(self)
+
+    def comprobar_salud(self, timeout=2.0):
+        """Consulta /models en todos los endpoints. Devuelve True si al menos uno responde."""
+        for endpoint in self.endpoints:
+            inicio = time.monotonic()
+            try:
+                endpoint.client.with_options(timeout=timeout).models.list()
+                endpoint.sano = True
+                if endpoint.latencia is None:
+                    endpoint.latencia = time.monotonic() - inicio
+            except Exception:
+                endpoint.registrar_fallo()
+        return any(endpoint.sano for endpoint in self.endpoints)
+
+    def candidatos(self):
+        """Endpoints en orden de preferencia. Los caídos se vuelven a probar pasado 'reintento_caidos'."""
+        ahora = time.monotonic()
+        with self._lock:
+            disponibles = [
+                e for e in self.endpoints
+                if e.sano or ahora - e.ultimo_fallo >= self.reintento_caidos
+            ]
+            caidos = [e for e in self.endpoints if e not in disponibles]
+            return sorted(disponibles, key=Endpoint.puntuacion) + caidos
+
+    def elegir(self):
+        return self.candidatos()[0]
+
+    def crear_completion(self, **kwargs):
+        ultimo_error = None
+        for endpoint in self.candidatos():
+            with self._lock:
+                endpoint.en_vuelo += 1
+            inicio = time.monotonic()
+            entregado = False
+            try:
+                resultado = endpoint.client.chat.completions.create(**kwargs)
+                if kwargs.get("stream"):
+                    # En streaming la petición sigue en curso (y se mide) hasta consumir el stream
+                    entregado = True
+                    return _StreamMedido(self, endpoint, resultado, inicio)
+                endpoint.registrar_exito(time.monotonic() - inicio)
+                return resultado
+            except (APIConnectionError, APITimeoutError) as e:
+                ultimo_error = e
+            except APIStatusError as e:
+                if e.status_code < 500:
+                    raise
+                ultimo_error = e
+            finally:
+                if not entregado:
+                    with self._lock:
+                        endpoint.en_vuelo -= 1
+            endpoint.registrar_fallo()
+            print(f"⚠️ Fallo en {endpoint.url} ({type(ultimo_error).__name__}); probando el siguiente endpoint...")
+        raise ultimo_error
+
+    def resumen(self):
+        for endpoint in self.endpoints:
+            latencia = f"{endpoint.latencia:.2f}s" if endpoint.latencia is not None else "n/d"
+            estado = "✅" if endpoint.sano else "❌"
+            print(f"   {estado} {endpoint.url}: {endpoint.peticiones} peticiones, {endpoint.fallos} fallos, latencia {latencia}")
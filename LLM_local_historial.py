@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import threading
+from datetime import datetime
+
+# Historial en JSONL: una línea por mensaje, escrita según ocurre.
+# Los mensajes de sistema se guardan completos una sola vez y después solo por su hash.
+
+def ruta_historial(memory_limit, model_name, extension="jsonl"):
+    carpeta_historial = os.path.join(os.path.dirname(os.path.abspath(__file__)), "historial")
+    os.makedirs(carpeta_historial, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(
+        carpeta_historial,
+        f"historial_{timestamp}_memory_size_{memory_limit}_{(model_name or '').replace('/', '-')}.{extension}"
+    )
+
+def hash_prompt(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()[:16]
+
+class HistorialJSONL:
+    def __init__(self, ruta, tam_lote=16, intervalo=1.0):
+        self.ruta = ruta
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.escritos = 0
+        self._hashes = set()
+        self._cola = queue.Queue()
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._escribir, name="historial_jsonl", daemon=True)
+        self._hilo.start()
+
+    def agregar(self, mensaje, **extra):
+        """Encola un mensaje {'role', 'content'} con campos adicionales (latencias, índices...)."""
+        if self._cerrado:
+            return
+        registro = {"ts": time.time(), "role": mensaje["role"]}
+        if mensaje["role"] == "system":
+            h = hash_prompt(mensaje["content"])
+            registro["hash"] = h
+            if h not in self._hashes:
+                self._hashes.add(h)
+                registro["content"] = mensaje["content"]
+        else:
+            registro["content"] = mensaje["content"]
+        registro.update(extra)
+        self._cola.put(registro)
+
+    def cerrar(self):
+        """Vacía la cola pendiente y espera a que el hilo termine de escribir."""
+        if self._cerrado:
+            return
+        self._cerrado = True
+        self._cola.put(None)
+        self._hilo.join()
+
+    def _escribir(self):
+        with open(self.ruta, "a", encoding="utf-8") as f:
+            lote = []
+            ultimo_volcado = time.monotonic()
+            terminar = False
+            while not terminar:
+                try:
+                    registro = self._cola.get(timeout=self.intervalo)
+                    if registro is None:
+                        terminar = True
+                    else:
+                        lote.append(json.dumps(registro, ensure_ascii=False))
+                except queue.Empty:
+                    pass
+                if lote and (terminar or len(lote) >= self.tam_lote
+                             or time.monotonic() - ultimo_volcado >= self.intervalo):
+                    f.write("\n".join(lote) + "\n")
+                    f.flush()
+                    self.escritos += len(lote)
+                    lote = []
+                    ultimo_volcado = time.monotonic()
+
+def cargar_historial_jsonl(ruta):
+    """Reconstruye el formato antiguo {"messages": [...]} a partir de un historial JSONL."""
+    prompts = {}
+    mensajes = []
+    with open(ruta, "r", encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                # Última línea truncada por un corte brusco
+                continue
+            registro.pop("ts", None)
+            if registro["role"] == "system":
+                h = registro.pop("hash")
+                if "content" in registro:
+                    prompts[h] = registro["content"]
+                else:
+                    registro["content"] = prompts.get(h, "")
+            mensajes.append(registro)
+    return {"messages": mensajes}
+
+def convertir_a_json(ruta_jsonl, ruta_json=None):
+    ruta_json = ruta_json or os.path.splitext(ruta_jsonl)[0] + ".json"
+    with open(ruta_json, "w", encoding="utf-8") as f:
+        json.dump(cargar_historial_jsonl(ruta_jsonl), f, ensure_ascii=False, indent=2)
+    print(f"💾 Historial convertido en: {ruta_json}")
+    return ruta_json
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python LLM_local_historial.py historial.jsonl [salida.json]")
+        sys.exit(1)
+    convertir_a_json(*sys.argv[1:3])
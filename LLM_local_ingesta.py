@@ -0,0 +1,193 @@
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+from collections import deque
+from LLM_local_dataset import iterar_muestras
+
+# Ingesta en vivo de muestras del robot: diccionarios de estado en JSON, uno por línea, leídos de un
+# socket TCP local o de una tubería/fichero. Se guardan en una cola acotada; si el LLM va por detrás,
+# "descartar_antiguas" quita la muestra pendiente más antigua y "fusionar" sustituye la más reciente
+# pendiente por la nueva (los estados intermedios se funden en el último), conservando el contexto anterior.
+
+POLITICAS = ("descartar_antiguas", "fusionar")
+
+class ColaMuestras:
+    def __init__(self, capacidad=8, politica="descartar_antiguas"):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de cola desconocida: {politica!r} (válidas: {', '.join(POLITICAS)})")
+        self.capacidad = capacidad
+        self.politica = politica
+        self._muestras = deque()
+        self._condicion = threading.Condition()
+        self.cerrada = False
+        self.recibidas = 0
+        self.descartadas = 0
+        self.fusionadas = 0
+        self.invalidas = 0
+        self.profundidad_max = 0
+
+    def __len__(self):
+        return len(self._muestras)
+
+    def poner(self, msg):
+        with self._condicion:
+            self.recibidas += 1
+            if len(self._muestras) >= self.capacidad:
+                if self.politica == "descartar_antiguas":
+                    self._muestras.popleft()
+                    self.descartadas += 1
+                else:
+                    self._muestras.pop()
+                    self.fusionadas += 1
+            self._muestras.append((time.monotonic(), msg))
+            self.profundidad_max = max(self.profundidad_max, len(self._muestras))
+            self._condicion.notify()
+
+    def extraer_todas(self, timeout=None):
+        """Espera a que haya muestras y devuelve todas las pendientes como (llegada, muestra).
+        Devuelve [] si vence el timeout y None si la cola está cerrada y vacía."""
+        with self._condicion:
+            if not self._muestras and not self.cerrada:
+                self._condicion.wait(timeout)
+            if not self._muestras:
+                return None if self.cerrada else []
+            pendientes = list(self._muestras)
+            self._muestras.clear()
+            return pendientes
+
+    def cerrar(self):
+        with self._condicion:
+            self.cerrada = True
+            self._condicion.notify_all()
+
+    def estadisticas(self):
+        return {
+            "recibidas": self.recibidas, "descartadas": self.descartadas, "fusionadas": self.fusionadas,
+            "invalidas": self.invalidas, "profundidad": len(self._muestras), "profundidad_max": self.profundidad_max,
+        }
+
+    def resumen(self):
+        e = self.estadisticas()
+        print(
+            f"📥 Ingesta ({self.politica}, capacidad {self.capacidad}): {e['recibidas']} recibidas, "
+            f"{e['descartadas']} descartadas, {e['fusionadas']} fusionadas, {e['invalidas']} inválidas, "
+            f"profundidad máxima {e['profundidad_max']}"
+        )
+        return e
+
+def parsear_linea(linea, cola):
+    linea = linea.strip()
+    if not linea:
+        return
+    try:
+        msg = json.loads(linea)
+    except json.JSONDecodeError:
+        msg = None
+    if not isinstance(msg, dict) or "time_mission_start" not in msg:
+        cola.invalidas += 1
+        return
+    cola.poner(msg)
+
+def leer_flujo(flujo, cola):
+    for linea in flujo:
+        parsear_linea(linea, cola)
+
+def iniciar_lector_socket(cola, host="127.0.0.1", puerto=5555, una_conexion=False):
+    """Escucha en un socket TCP local; cada conexión envía muestras línea a línea.
+    Con una_conexion, la cola se cierra cuando se desconecta el primer productor."""
+    class Manejador(socketserver.StreamRequestHandler):
+        def handle(self):
+            leer_flujo((linea.decode("utf-8", errors="replace") for linea in self.rfile), cola)
+            if una_conexion:
+                cola.cerrar()
+
+    servidor = socketserver.ThreadingTCPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    hilo = threading.Thread(target=servidor.serve_forever, name="ingesta_socket", daemon=True)
+    hilo.start()
+    return servidor
+
+def iniciar_lector_fichero(cola, ruta="-"):
+    """Lee muestras de una tubería con nombre, un fichero JSONL o la entrada estándar ('-'). Al terminar cierra la cola."""
+    def leer():
+        try:
+            if ruta == "-":
+                leer_flujo(sys.stdin, cola)
+            else:
+                with open(ruta, "r", encoding="utf-8") as f:
+                    leer_flujo(f, cola)
+        finally:
+            cola.cerrar()
+
+    hilo = threading.Thread(target=leer, name="ingesta_fichero", daemon=True)
+    hilo.start()
+    return hilo
+
+def separar_direccion(direccion):
+    host, _, puerto = direccion[len("tcp://"):].rpartition(":")
+    return host or "127.0.0.1", int(puerto)
+
+def abrir_fuente(direccion, cola, una_conexion=False):
+    """'tcp://host:puerto' escucha en un socket; cualquier otra cosa es una ruta de tubería/fichero o '-'."""
+    if direccion.startswith("tcp://"):
+        host, puerto = separar_direccion(direccion)
+        return iniciar_lector_socket(cola, host, puerto, una_conexion)
+    return iniciar_lector_fichero(cola, direccion)
+
+def producir(mensajes, destino="tcp://127.0.0.1:5555", velocidad=1.0, reintentos=50):
+    """Productor local: envía las muestras de un dataset al ritmo de 'time_mission_start' (velocidad > 1 acelera)."""
+    if destino.startswith("tcp://"):
+        direccion = separar_direccion(destino)
+        for intento in range(reintentos):
+            try:
+                conexion = socket.create_connection(direccion)
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.2)
+        else:
+            raise ConnectionRefusedError(f"No hay nadie escuchando en {destino}")
+        salida = conexion.makefile("w", encoding="utf-8")
+    else:
+        conexion = None
+        salida = sys.stdout if destino == "-" else open(destino, "w", encoding="utf-8")
+    enviadas = 0
+    try:
+        t0 = None
+        inicio = time.monotonic()
+        for msg in mensajes:
+            if t0 is None:
+                t0 = msg["time_mission_start"]
+            espera = (msg["time_mission_start"] - t0) / velocidad - (time.monotonic() - inicio)
+            if espera > 0:
+                time.sleep(espera)
+            salida.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            salida.flush()
+            enviadas += 1
+    finally:
+        if salida is not sys.stdout:
+            salida.close()
+        if conexion:
+            conexion.close()
+    return enviadas
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Productor local: reproduce un dataset como flujo de muestras en vivo")
+    parser.add_argument("dataset", help="dataset .json ({'messages': [...]}) o .jsonl de la carpeta 'dataset/'")
+    parser.add_argument("--destino", default="tcp://127.0.0.1:5555", help="tcp://host:puerto, ruta de tubería o '-'")
+    parser.add_argument("--velocidad", type=float, default=1.0, help="factor de aceleración sobre el tiempo real")
+    parser.add_argument("--desde", type=float, help="empieza en este instante de time_mission_start")
+    args = parser.parse_args()
+
+    mensajes = iterar_muestras(args.dataset, args.desde)
+    if args.destino != "-":
+        print(f"📤 Enviando muestras de {args.dataset} a {args.destino} (x{args.velocidad})...")
+    try:
+        enviadas = producir(mensajes, args.destino, args.velocidad)
+    except KeyboardInterrupt:
+        sys.exit(0)
+    if args.destino != "-":
+        print(f"✅ {enviadas} muestras enviadas")
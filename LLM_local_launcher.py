@@ -6,10 +6,16 @@ import time
 import signal
 import sys
 import psutil
+import argparse
 from openai import OpenAI
 import json
+from LLM_local_prompts import MAIN_PROMPT
+from LLM_local_dataset import listar_json_dataset, seleccionar_json, cargar_json
+from LLM_local_metricas import perfil, iniciar_servidor_metricas
+import LLM_local_benchmark as benchmark
 
-LMSTUDIO_API_URL = "http://localhost:3000/v1/models"
+LMSTUDIO_BASE_URL = "http://localhost:3000/v1"
+LMSTUDIO_API_URL = f"{LMSTUDIO_BASE_URL}/models"
 MODEL_NAME = ""
 LMS_PATH = "/home/gerardo/.lmstudio/bin/lms"
 LM_STUDIO_APPIMAGE = "/home/gerardo/Documents/test_scripts/lm_studio/LM-Studio-0.3.20-4-x64.AppImage"
@@ -18,63 +24,74 @@ server_proc = None
 modelo_proc = None
 appimage_proc = None
 
-# ------------------- NUEVO -------------------
-def listar_json_dataset():
-    """Lista los archivos .json dentro de la carpeta 'dataset' en el mismo directorio del script."""
-    dataset_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset")
-    if not os.path.exists(dataset_dir):
-        print(f"❌ No existe la carpeta: {dataset_dir}")
-        return []
+# Calentamiento: peticiones con el prompt de sistema real de los runners tras cargar el modelo
+WARMUP_REQUESTS = 2
+# Tiempo de vida del modelo sin uso, en segundos (None: permanece cargado hasta 'lms unload')
+MODEL_TTL = None
+WARMUP_USER_MESSAGE = (
+    "\n- Tiempo 0.0: Shadow está detenido, Shadow está en salón, No estás ejecutando ningún affordance "
+    "La persona está a una distancia de 1.00 metros delante del robot y 0.10 metros derecha, "
+    "orientada en el mismo sentido que el robot. La persona no tiene intenciones de interacción\n                "
+)
 
-    archivos_json = [f for f in os.listdir(dataset_dir) if f.endswith(".json")]
-    return [os.path.join(dataset_dir, f) for f in archivos_json]
+# Barrido de modelos (--barrido): fracción mínima de respuestas válidas para entrar en el ranking
+SWEEP_MIN_VALIDITY = 0.9
 
-def seleccionar_json():
-    """Permite seleccionar un archivo JSON de la carpeta dataset."""
-    archivos = listar_json_dataset()
-    if not archivos:
-        print("⚠️ No se encontraron archivos .json en la carpeta 'dataset'.")
-        return None
+# Perfilado de las fases de arranque (ver LLM_local_metricas.py); con PROFILING_PORT, también en /metrics
+PROFILING = False
+PROFILING_PORT = None
+
+# Sesión HTTP reutilizada (keep-alive) para los sondeos de disponibilidad
+sesion_http = requests.Session()
+# Duración de cada fase del arranque, en segundos
+tiempos_arranque = {}
 
-    print("\n📂 Archivos JSON disponibles en 'dataset':")
-    for i, archivo in enumerate(archivos):
-        print(f"{i+1}. {os.path.basename(archivo)}")
+def registrar_fase(fase, duracion):
+    tiempos_arranque[fase] = duracion
+    perfil.registrar(f"arranque.{fase}", duracion)
 
+def esperar_condicion(condicion, timeout=60, espera_inicial=0.05, factor=2.0, espera_max=1.0):
+    """Evalúa 'condicion' con backoff exponencial hasta que devuelva True.
+    Devuelve los segundos transcurridos, o None si se agota el timeout."""
+    inicio = time.monotonic()
+    espera = espera_inicial
     while True:
-        try:
-            eleccion = int(input("\nElige un archivo (número, 0 para cancelar): "))
-            if eleccion == 0:
-                return None
-            if 1 <= eleccion <= len(archivos):
-                return archivos[eleccion - 1]
-            else:
-                print("❗ Opción fuera de rango.")
-        except ValueError:
-            print("❗ Introduce un número válido.")
+        if condicion():
+            return time.monotonic() - inicio
+        restante = timeout - (time.monotonic() - inicio)
+        if restante <= 0:
+            return None
+        time.sleep(min(espera, restante))
+        espera = min(espera * factor, espera_max)
 
-def cargar_json(ruta_json):
-    """Carga el archivo JSON que contiene 'messages' y devuelve la lista."""
+def api_disponible():
     try:
-        with open(ruta_json, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if "messages" not in data or not isinstance(data["messages"], list):
-            raise ValueError("El JSON no contiene la clave 'messages' con una lista.")
-        return data["messages"]
-    except Exception as e:
-        print(f"❌ Error al leer el JSON: {e}")
-        return []
-# ----------------------------------------------
+        return sesion_http.get(LMSTUDIO_API_URL, timeout=2).status_code == 200
+    except requests.exceptions.RequestException:
+        return False
 
 def iniciar_lm_studio():
     global appimage_proc
     print("🚀 Lanzando LM Studio AppImage...")
+    inicio = time.monotonic()
     appimage_proc = subprocess.Popen([LM_STUDIO_APPIMAGE], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    time.sleep(5)
+    # La AppImage está lista para 'lms' cuando el CLI responde
+    transcurrido = esperar_condicion(
+        lambda: appimage_proc.poll() is None and subprocess.run(
+            [LMS_PATH, "status"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ).returncode == 0,
+        timeout=30,
+    )
+    registrar_fase("proceso", time.monotonic() - inicio)
+    if transcurrido is None:
+        print("⚠️ LM Studio no respondió al CLI en el tiempo esperado; se continúa.")
 
 def lanzar_lmstudio_server():
     global server_proc
     print("🚀 Iniciando LM Studio server...")
+    inicio = time.monotonic()
     server_proc = subprocess.run([LMS_PATH, "server", "start"], check=True)
+    registrar_fase("servidor_lanzado", time.monotonic() - inicio)
 
 def cerrar_lmstudio_server():
     global server_proc
@@ -85,19 +102,63 @@ def cerrar_lmstudio_server():
 
 def esperar_api(timeout=60):
     print("⏳ Esperando a que la API de LM Studio esté disponible...")
-    inicio = time.time()
-    while time.time() - inicio < timeout:
-        try:
-            r = requests.get(LMSTUDIO_API_URL)
-            if r.status_code == 200:
-                print("✅ LM Studio API está activa.")
-                return True
-        except requests.exceptions.ConnectionError:
-            pass
-        time.sleep(1)
+    transcurrido = esperar_condicion(api_disponible, timeout)
+    if transcurrido is not None:
+        if "servidor_activo" not in tiempos_arranque:
+            registrar_fase("servidor_activo", transcurrido)
+        print("✅ LM Studio API está activa.")
+        return True
     print("❌ Timeout: la API de LM Studio no respondió.")
     return False
 
+def modelos_cargados():
+    try:
+        resultado = subprocess.run(
+            [LMS_PATH, "ps", "--json"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            text=True
+        )
+        return json.loads(resultado.stdout)
+    except (subprocess.CalledProcessError, json.JSONDecodeError):
+        return None
+
+def modelo_cargado(modelo_seleccionado):
+    modelos = modelos_cargados() or []
+    return any(modelo_seleccionado in (m.get("identifier"), m.get("modelKey"), m.get("path")) for m in modelos)
+
+def primer_token(modelo_seleccionado):
+    """Pide un único token al modelo; True si el servidor ya genera."""
+    try:
+        client = OpenAI(base_url=LMSTUDIO_BASE_URL, api_key="lm-studio", max_retries=0, timeout=30)
+        client.chat.completions.create(
+            model=modelo_seleccionado,
+            messages=[{"role": "user", "content": "ok"}],
+            max_tokens=1,
+        )
+        return True
+    except Exception:
+        return False
+
+def imprimir_tiempos_arranque():
+    fases = [
+        ("proceso", "Lanzamiento de LM Studio"),
+        ("servidor_lanzado", "lms server start"),
+        ("servidor_activo", "API activa"),
+        ("carga_lms", "lms load"),
+        ("modelo_cargado", "Modelo en 'lms ps'"),
+        ("primer_token", "Primer token"),
+        ("calentamiento", "Calentamiento"),
+    ]
+    print("\n⏱️ Tiempos de arranque:")
+    total = 0.0
+    for clave, descripcion in fases:
+        if clave in tiempos_arranque:
+            total += tiempos_arranque[clave]
+            print(f"   {descripcion:<28} {tiempos_arranque[clave]:6.2f}s")
+    print(f"   {'Total':<28} {total:6.2f}s\n")
+
 def obtener_modelos_lmstudio():
     try:
         resultado = subprocess.run(
@@ -113,6 +174,95 @@ def obtener_modelos_lmstudio():
         print("❌ Error al obtener la lista de modelos:", e.stderr)
         return []
 
+def filtrar_llms(modelos_disponibles, incluir=None, excluir=None):
+    """LLMs instalados cuyo registro de 'lms ls' contiene alguno de 'incluir' y ninguno de 'excluir'
+    (sin distinguir mayúsculas: sirve para nombre, arquitectura, parámetros o cuantización)."""
+    llms = []
+    for modelo in modelos_disponibles:
+        if modelo.get("type") != "llm":
+            continue
+        texto = json.dumps(modelo, ensure_ascii=False).lower()
+        if incluir and not any(patron.lower() in texto for patron in incluir):
+            continue
+        if excluir and any(patron.lower() in texto for patron in excluir):
+            continue
+        llms.append(modelo)
+    return llms
+
+def barrido_modelos(llms, ruta_dataset, memory_limit=None, validez_minima=SWEEP_MIN_VALIDITY, carpeta=None):
+    """Para cada modelo: cargar, calentar, reproducir el dataset con el runner de series temporales,
+    descargar. Devuelve las filas de resumen ordenadas: primero los válidos, del más rápido al más lento.
+    Los modelos que no se pueden cargar se anotan como fallidos y el barrido sigue con el siguiente."""
+    mensajes = cargar_json(ruta_dataset)
+    if not mensajes:
+        return []
+    runner = benchmark.runner
+    runner.LMSTUDIO_API_URL, runner.LMSTUDIO_API_URLS = LMSTUDIO_BASE_URL, None
+    memory_limit = runner.memory_limit if memory_limit is None else memory_limit
+    resultados = []
+    filas = []
+    fallidos = []
+    for i, modelo in enumerate(llms):
+        clave = modelo["modelKey"]
+        print(f"\n▶️ [{i+1}/{len(llms)}] {clave} ({modelo.get('paramsString', '?')})")
+        borrar_modelo()
+        tiempos_arranque.clear()
+        try:
+            cargado = cargar_modelo(clave)
+            motivo = "timeout"
+        except (subprocess.CalledProcessError, OSError) as e:
+            # 'lms load' falla, p. ej., sin memoria suficiente o con una cuantización no soportada
+            cargado = False
+            motivo = str(e)
+        if not cargado:
+            print(f"⚠️ No se pudo cargar '{clave}' ({motivo}); se pasa al siguiente.")
+            fallidos.append({"modelo": clave, "motivo": motivo})
+            borrar_modelo()
+            continue
+        carga = sum(tiempos_arranque.get(fase, 0.0) for fase in ("carga_lms", "modelo_cargado", "primer_token"))
+        latencias = calentar_modelo(clave)
+        try:
+            resultado = benchmark.ejecutar_configuracion(
+                clave, ruta_dataset, mensajes, memory_limit, runner.memory_sliding_window_size, "base"
+            )
+        finally:
+            descarga = borrar_modelo()
+        fila = benchmark.resumir(resultado)
+        estadisticas = resultado["estadisticas"]
+        # Respuestas válidas sobre intentos: las peticiones completadas (las que no se pudieron parsear no
+        # cuentan como válidas) más las que fallaron por error, que no llegan a contar como peticiones
+        validas = estadisticas["peticiones"] - estadisticas["fallos_parseo"]
+        intentos = estadisticas["peticiones"] + estadisticas["errores"]
+        fila.update({
+            "carga_s": carga,
+            "descarga_s": descarga,
+            "calentamiento_frio_s": latencias[0] if latencias else None,
+            "validez": validas / intentos if intentos else 0.0,
+        })
+        resultados.append(resultado)
+        filas.append(fila)
+        print(f"   carga {carga:.1f}s | p50 {fila['total_p50'] or 0:.2f}s | validez {fila['validez']:.0%}")
+
+    # Ranking: primero los que dan respuestas de Shadow válidas, por latencia mediana
+    filas.sort(key=lambda f: (f["validez"] < validez_minima, f["total_p50"] if f["total_p50"] is not None else float("inf")))
+    imprimir_ranking(filas, validez_minima)
+    if fallidos:
+        print(f"⚠️ Sin cargar ({len(fallidos)}): " + ", ".join(f"{f['modelo']} ({f['motivo']})" for f in fallidos))
+    if filas:
+        benchmark.guardar_resultados(resultados, filas, carpeta or os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"),
+                                     {"fallidos": fallidos})
+    return filas
+
+def imprimir_ranking(filas, validez_minima=SWEEP_MIN_VALIDITY):
+    print(f"\n🏁 Ranking de modelos (validez mínima {validez_minima:.0%}):")
+    print(f"   {'#':>2} {'modelo':<40} {'validez':>7} {'p50':>6} {'p95':>6} {'ttft50':>6} {'tok/s':>7} {'carga':>6} {'descarga':>8}")
+    def f(valor, ancho=6, decimales=2):
+        return f"{valor:{ancho}.{decimales}f}" if valor is not None else f"{'-':>{ancho}}"
+    for i, fila in enumerate(filas):
+        marca = "" if fila["validez"] >= validez_minima else " ❌"
+        print(f"   {i+1:>2} {fila['modelo'][:40]:<40} {fila['validez']:>7.0%} {f(fila['total_p50'])} {f(fila['total_p95'])} "
+              f"{f(fila['ttft_p50'])} {f(fila['tokens_s_p50'], 7, 1)} {f(fila['carga_s'], 6, 1)} {f(fila['descarga_s'], 8, 1)}{marca}")
+
 def elegir_llm(modelos_disponibles):
     llms = [m for m in modelos_disponibles if m.get("type") == "llm"]
     if not llms:
@@ -133,17 +283,75 @@ def elegir_llm(modelos_disponibles):
         except ValueError:
             print("❗ Introduce un número válido.")
 
-def cargar_modelo(modelo_seleccionado):
+def cargar_modelo(modelo_seleccionado, timeout=300):
     print(f"📦 Cargando modelo '{modelo_seleccionado}'...")
-    subprocess.run([LMS_PATH, "load", modelo_seleccionado], check=True)
-    time.sleep(3)
+    inicio = time.monotonic()
+    comando = [LMS_PATH, "load", modelo_seleccionado]
+    if MODEL_TTL:
+        comando += ["--ttl", str(int(MODEL_TTL))]
+    subprocess.run(comando, check=True)
+    registrar_fase("carga_lms", time.monotonic() - inicio)
+
+    transcurrido = esperar_condicion(lambda: modelo_cargado(modelo_seleccionado), timeout, espera_max=2.0)
+    if transcurrido is None:
+        print("❌ Timeout: el modelo no aparece como cargado en 'lms ps'.")
+        return False
+    registrar_fase("modelo_cargado", transcurrido)
 
-def borrar_modelo():
+    transcurrido = esperar_condicion(lambda: primer_token(modelo_seleccionado), timeout, espera_max=2.0)
+    if transcurrido is None:
+        print("❌ Timeout: el modelo no generó ningún token.")
+        return False
+    registrar_fase("primer_token", transcurrido)
+    print("✅ Modelo listo.")
+    return True
+
+def calentar_modelo(modelo_seleccionado, repeticiones=WARMUP_REQUESTS):
+    """Envía peticiones con el prompt de sistema de Shadow para dejar el modelo y su caché de prefijo listos.
+    Devuelve las latencias: la primera es la fría, el resto calientes."""
+    if repeticiones <= 0:
+        return []
+    print(f"🔥 Calentando modelo con {repeticiones} peticiones...")
+    client = OpenAI(base_url=LMSTUDIO_BASE_URL, api_key="lm-studio")
+    extra_body = {"ttl": int(MODEL_TTL)} if MODEL_TTL else None
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.monotonic()
+        try:
+            client.chat.completions.create(
+                model=modelo_seleccionado,
+                messages=[
+                    {"role": "system", "content": MAIN_PROMPT},
+                    {"role": "user", "content": WARMUP_USER_MESSAGE},
+                ],
+                temperature=0.5,
+                max_tokens=8,
+                extra_body=extra_body,
+            )
+        except Exception as e:
+            print("❌ Error durante el calentamiento:", e)
+            break
+        latencias.append(time.monotonic() - inicio)
+    if latencias:
+        registrar_fase("calentamiento", sum(latencias))
+        calientes = latencias[1:]
+        texto_calientes = f"{sum(calientes) / len(calientes):.2f}s" if calientes else "n/d"
+        print(f"✅ Calentamiento: fría {latencias[0]:.2f}s, caliente {texto_calientes} de media")
+    return latencias
+
+def borrar_modelo(timeout=30):
+    """Descarga todos los modelos. Devuelve lo que tarda hasta que 'lms ps' queda vacío (None si falla)."""
+    inicio = time.monotonic()
     try:
         subprocess.run([LMS_PATH, "unload", "--all"], check=True)
-        time.sleep(3)
+        if esperar_condicion(lambda: modelos_cargados() == [], timeout) is None:
+            print("⚠️ Siguen apareciendo modelos cargados tras 'lms unload'.")
+            return None
     except:
         print("❌ Error al borrar el modelo.")
+        return None
+    registrar_fase("descarga", time.monotonic() - inicio)
+    return tiempos_arranque["descarga"]
 
 def cerrar_procesos():
     print("\n🛑 Cerrando procesos...")
@@ -212,16 +420,54 @@ def chat_local(modelo_seleccionado, mensajes_json=None):
                 break
 # ---------------------------------------------------
 
+if __name__ == "__main__" and "--barrido" in sys.argv:
+    # Barrido no interactivo: python LLM_local_launcher.py --barrido --incluir qwen gemma --excluir q8
+    parser = argparse.ArgumentParser(description="Barrido de modelos instalados en LM Studio")
+    parser.add_argument("--barrido", action="store_true")
+    parser.add_argument("--incluir", nargs="+", help="solo modelos cuyo registro de 'lms ls' contenga alguno de estos textos")
+    parser.add_argument("--excluir", nargs="+", help="descarta modelos que contengan alguno de estos textos")
+    parser.add_argument("--dataset", help="dataset a reproducir (por defecto, el primero de 'dataset/')")
+    parser.add_argument("--memory-limit", type=int)
+    parser.add_argument("--validez-minima", type=float, default=SWEEP_MIN_VALIDITY)
+    args = parser.parse_args()
+
+    # Las señales solo salen: el servidor se cierra una vez, en el finally
+    signal.signal(signal.SIGINT, lambda sig, frame: sys.exit(0))
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    try:
+        iniciar_lm_studio()
+        lanzar_lmstudio_server()
+        if esperar_api():
+            llms = filtrar_llms(obtener_modelos_lmstudio(), args.incluir, args.excluir)
+            ruta_dataset = args.dataset or next(iter(sorted(listar_json_dataset())), None)
+            if not llms or not ruta_dataset:
+                print("❌ No hay modelos o dataset para el barrido.")
+            else:
+                print(f"🔁 Barrido de {len(llms)} modelos sobre {os.path.basename(ruta_dataset)}")
+                barrido_modelos(llms, ruta_dataset, args.memory_limit, args.validez_minima)
+    finally:
+        cerrar_procesos()
+    sys.exit(0)
+
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    perfil.activo = PROFILING
+    if PROFILING and PROFILING_PORT is not None:
+        iniciar_servidor_metricas(PROFILING_PORT)
     iniciar_lm_studio()
     lanzar_lmstudio_server()
 
     if esperar_api():
         modelos = obtener_modelos_lmstudio()
         modelo_seleccionado = elegir_llm(modelos)
-        cargar_modelo(modelo_seleccionado)
+        if cargar_modelo(modelo_seleccionado):
+            calentar_modelo(modelo_seleccionado)
+        imprimir_tiempos_arranque()
+        if PROFILING:
+            carpeta = os.path.join(os.path.dirname(os.path.abspath(__file__)), "historial")
+            os.makedirs(carpeta, exist_ok=True)
+            perfil.volcar(os.path.join(carpeta, f"perfil_arranque_{time.strftime('%Y%m%d_%H%M%S')}.json"))
 
         try:
             while esperar_api():
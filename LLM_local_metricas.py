@@ -0,0 +1,147 @@
+import json
+import time
+import bisect
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Perfilado por etapas: tramos medidos con reloj monotónico (perf_counter) que se acumulan en histogramas.
+# Desactivado, perfil.tramo() devuelve siempre el mismo contexto vacío y no mide nada.
+# Los histogramas se vuelcan a JSON y se pueden consultar en formato Prometheus en /metrics.
+
+# Límites superiores de los cubos del histograma, en segundos
+CUBOS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NULO = contextlib.nullcontext()
+
+class Histograma:
+    def __init__(self):
+        self.cubos = [0] * (len(CUBOS) + 1)
+        self.n = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+
+    def agregar(self, valor):
+        self.cubos[bisect.bisect_left(CUBOS, valor)] += 1
+        self.n += 1
+        self.suma += valor
+        if valor > self.maximo:
+            self.maximo = valor
+
+    def percentil(self, p):
+        """Aproximación por el límite superior del cubo que contiene el percentil."""
+        if not self.n:
+            return None
+        objetivo = self.n * p / 100
+        acumulado = 0
+        for limite, cuenta in zip(CUBOS + (self.maximo,), self.cubos):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return min(limite, self.maximo)
+        return self.maximo
+
+    def a_dict(self):
+        return {
+            "n": self.n, "suma": self.suma, "media": self.suma / self.n if self.n else None, "max": self.maximo,
+            "p50": self.percentil(50), "p95": self.percentil(95),
+            "cubos": dict(zip([str(c) for c in CUBOS] + ["+Inf"], self.cubos)),
+        }
+
+class _Tramo:
+    __slots__ = ("perfilador", "nombre", "inicio")
+
+    def __init__(self, perfilador, nombre):
+        self.perfilador = perfilador
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.perfilador.registrar(self.nombre, time.perf_counter() - self.inicio)
+        return False
+
+class Perfilador:
+    def __init__(self, activo=False):
+        self.activo = activo
+        self.histogramas = {}
+        self._lock = threading.Lock()
+
+    def tramo(self, nombre):
+        """with perfil.tramo("parseo"): ... mide el bloque si el perfilado está activo."""
+        if not self.activo:
+            return _NULO
+        return _Tramo(self, nombre)
+
+    def registrar(self, nombre, duracion):
+        if not self.activo or duracion is None:
+            return
+        with self._lock:
+            histograma = self.histogramas.get(nombre)
+            if histograma is None:
+                histograma = self.histogramas[nombre] = Histograma()
+            histograma.agregar(duracion)
+
+    def reiniciar(self):
+        with self._lock:
+            self.histogramas = {}
+
+    def a_dict(self):
+        with self._lock:
+            return {nombre: h.a_dict() for nombre, h in sorted(self.histogramas.items())}
+
+    def volcar(self, ruta):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump({"ts": time.time(), "tramos": self.a_dict()}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Perfil por etapas guardado en: {ruta}")
+        return ruta
+
+    def resumen(self):
+        tramos = self.a_dict()
+        if not tramos:
+            return
+        print(f"\n⏱️ Perfil por etapas:\n   {'tramo':<24} {'n':>6} {'total':>9} {'media':>9} {'p95':>9} {'máx':>9}")
+        for nombre, d in sorted(tramos.items(), key=lambda item: -item[1]["suma"]):
+            print(f"   {nombre:<24} {d['n']:>6} {d['suma']:8.3f}s {d['media']*1000:7.2f}ms "
+                  f"{d['p95']*1000:7.2f}ms {d['max']*1000:7.2f}ms")
+
+    def texto_prometheus(self, prefijo="shadow_tramo_segundos"):
+        lineas = [f"# HELP {prefijo} Duración de cada etapa del runner", f"# TYPE {prefijo} histogram"]
+        with self._lock:
+            for nombre, h in sorted(self.histogramas.items()):
+                acumulado = 0
+                for limite, cuenta in zip([str(c) for c in CUBOS] + ["+Inf"], h.cubos):
+                    acumulado += cuenta
+                    lineas.append(f'{prefijo}_bucket{{tramo="{nombre}",le="{limite}"}} {acumulado}')
+                lineas.append(f'{prefijo}_sum{{tramo="{nombre}"}} {h.suma}')
+                lineas.append(f'{prefijo}_count{{tramo="{nombre}"}} {h.n}')
+        return "\n".join(lineas) + "\n"
+
+# Perfilador compartido por los scripts
+perfil = Perfilador()
+
+def iniciar_servidor_metricas(puerto=9464, host="127.0.0.1", perfilador=None):
+    """Sirve /metrics en formato de texto de Prometheus en un hilo. Devuelve el servidor."""
+    perfilador = perfilador or perfil
+
+    class Manejador(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            datos = perfilador.texto_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+    servidor = ThreadingHTTPServer((host, puerto), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    print(f"📈 Métricas en http://{host}:{servidor.server_address[1]}/metrics")
+    return servidor
@@ -0,0 +1,214 @@
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Servidor de pruebas compatible con la API OpenAI de LM Studio (/v1/models y /v1/chat/completions).
+# Simula la velocidad de procesado del prompt y de generación para poder perfilar el cliente sin modelo.
+
+MODELO_MOCK = "mock/shadow"
+RESPUESTA_POR_DEFECTO = '{"reasoning": "", "TTS": "", "time_next_inference": 2}'
+
+# Perfiles de latencia: tokens/s de procesado de prompt (pp) y de generación (tg)
+PERFILES = {
+    "instantaneo": {"pp": 0, "tg": 0, "latencia_base": 0.0, "jitter": 0.0},
+    "cpu": {"pp": 80, "tg": 8, "latencia_base": 0.05, "jitter": 0.1},
+    "gpu": {"pp": 2000, "tg": 60, "latencia_base": 0.02, "jitter": 0.05},
+}
+
+def contar_tokens(texto):
+    # Aproximación: ~4 caracteres por token, suficiente para simular tiempos
+    return max(1, len(texto) // 4) if texto else 0
+
+def trocear_tokens(texto):
+    return re.findall(r"\S+\s*|\s+", texto)
+
+class ConfigMock:
+    def __init__(self, perfil="instantaneo", pp=None, tg=None, latencia_base=None, jitter=None,
+                 tasa_errores=0.0, respuestas=None, modelos=None, semilla=None):
+        base = dict(PERFILES[perfil])
+        for clave, valor in (("pp", pp), ("tg", tg), ("latencia_base", latencia_base), ("jitter", jitter)):
+            if valor is not None:
+                base[clave] = valor
+        self.pp = base["pp"]
+        self.tg = base["tg"]
+        self.latencia_base = base["latencia_base"]
+        self.jitter = base["jitter"]
+        self.tasa_errores = tasa_errores
+        self.respuestas = respuestas or [RESPUESTA_POR_DEFECTO]
+        self.modelos = modelos or [MODELO_MOCK]
+        self.random = random.Random(semilla)
+        self.peticiones = 0
+        self._lock = threading.Lock()
+
+    def siguiente_respuesta(self):
+        with self._lock:
+            respuesta = self.respuestas[self.peticiones % len(self.respuestas)]
+            self.peticiones += 1
+            return respuesta
+
+    def factor_jitter(self):
+        return max(0.0, 1.0 + self.random.uniform(-self.jitter, self.jitter)) if self.jitter else 1.0
+
+def cargar_respuestas(ruta):
+    """Carga respuestas guionizadas: lista JSON de textos, o las respuestas 'assistant' de un historial JSONL."""
+    with open(ruta, "r", encoding="utf-8") as f:
+        if ruta.endswith(".jsonl"):
+            registros = [json.loads(l) for l in f if l.strip()]
+            return [r["content"] for r in registros if r.get("role") == "assistant" and r.get("content")]
+        datos = json.load(f)
+    if isinstance(datos, dict) and "messages" in datos:
+        return [m["content"] for m in datos["messages"] if m.get("role") == "assistant" and m.get("content")]
+    return [d if isinstance(d, str) else json.dumps(d, ensure_ascii=False) for d in datos]
+
+class ManejadorMock(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _enviar_json(self, estado, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        ruta = self.path.rstrip("/")
+        if ruta in ("/v1/models", "/v1"):
+            self._enviar_json(200, {
+                "object": "list",
+                "data": [{"id": m, "object": "model", "owned_by": "mock"} for m in self.config.modelos],
+            })
+        else:
+            self._enviar_json(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._enviar_json(404, {"error": {"message": f"Ruta desconocida: {self.path}"}})
+            return
+        longitud = int(self.headers.get("Content-Length", 0))
+        peticion = json.loads(self.rfile.read(longitud) or b"{}")
+        config = self.config
+
+        if config.tasa_errores and config.random.random() < config.tasa_errores:
+            self._enviar_json(500, {"error": {"message": "Error simulado del servidor mock"}})
+            return
+
+        prompt = "".join(str(m.get("content", "")) for m in peticion.get("messages", []))
+        prompt_tokens = contar_tokens(prompt)
+        respuesta = config.siguiente_respuesta()
+        tokens = trocear_tokens(respuesta)
+        if peticion.get("max_tokens"):
+            tokens = tokens[:peticion["max_tokens"]]
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        modelo = peticion.get("model") or config.modelos[0]
+        identificador = f"chatcmpl-mock-{config.peticiones}"
+        creado = int(time.time())
+
+        # Procesado del prompt (hasta el primer token)
+        espera = config.latencia_base + (prompt_tokens / config.pp if config.pp else 0.0)
+        time.sleep(espera * config.factor_jitter())
+        retardo_token = 1.0 / config.tg if config.tg else 0.0
+
+        if not peticion.get("stream"):
+            time.sleep(retardo_token * len(tokens) * config.factor_jitter())
+            self._enviar_json(200, {
+                "id": identificador,
+                "object": "chat.completion",
+                "created": creado,
+                "model": modelo,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def evento(delta, finish_reason=None, con_usage=False):
+            cuerpo = {
+                "id": identificador,
+                "object": "chat.completion.chunk",
+                "created": creado,
+                "model": modelo,
+                "choices": [] if con_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if con_usage:
+                cuerpo["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(cuerpo, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            evento({"role": "assistant", "content": ""})
+            for token in tokens:
+                if retardo_token:
+                    time.sleep(retardo_token * config.factor_jitter())
+                evento({"content": token})
+            evento({}, finish_reason="stop")
+            if (peticion.get("stream_options") or {}).get("include_usage"):
+                evento({}, con_usage=True)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente ha cancelado la petición
+            pass
+
+def iniciar_servidor_mock(host="127.0.0.1", puerto=3000, config=None):
+    """Arranca el servidor en un hilo. Devuelve el servidor (server.shutdown() para pararlo)."""
+    manejador = type("ManejadorMockConfigurado", (ManejadorMock,), {"config": config or ConfigMock()})
+    servidor = ThreadingHTTPServer((host, puerto), manejador)
+    servidor.daemon_threads = True
+    hilo = threading.Thread(target=servidor.serve_forever, name="mock_lmstudio", daemon=True)
+    hilo.start()
+    return servidor
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor mock compatible con la API de LM Studio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=3000)
+    parser.add_argument("--perfil", choices=sorted(PERFILES), default="instantaneo")
+    parser.add_argument("--pp", type=float, help="tokens/s de procesado del prompt")
+    parser.add_argument("--tg", type=float, help="tokens/s de generación")
+    parser.add_argument("--latencia-base", type=float, help="segundos fijos por petición")
+    parser.add_argument("--jitter", type=float, help="variación relativa de los tiempos (0.1 = ±10%%)")
+    parser.add_argument("--tasa-errores", type=float, default=0.0, help="fracción de peticiones que devuelven 500")
+    parser.add_argument("--respuestas", help="JSON con respuestas guionizadas o historial .jsonl grabado")
+    parser.add_argument("--modelo", action="append", help="identificador de modelo anunciado (repetible)")
+    parser.add_argument("--semilla", type=int)
+    args = parser.parse_args()
+
+    config = ConfigMock(
+        perfil=args.perfil, pp=args.pp, tg=args.tg, latencia_base=args.latencia_base, jitter=args.jitter,
+        tasa_errores=args.tasa_errores,
+        respuestas=cargar_respuestas(args.respuestas) if args.respuestas else None,
+        modelos=args.modelo, semilla=args.semilla,
+    )
+    servidor = iniciar_servidor_mock(args.host, args.puerto, config)
+    print(f"🧪 Servidor mock en http://{args.host}:{args.puerto}/v1 (pp={config.pp} tok/s, tg={config.tg} tok/s)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n🛑 Cerrando servidor mock...")
+        servidor.shutdown()
+        sys.exit(0)
@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+import psutil
+
+# Muestreo en segundo plano de los recursos del servidor de LM Studio y del sistema.
+# Los procesos se buscan igual que matar_lmstudio_en_tmp ('lm-studio' en la línea de comandos: la AppImage
+# y los procesos de Electron que lanza), más los binarios instalados en ~/.lmstudio (lms y los motores
+# de inferencia). Los intérpretes de Python nunca cuentan: los runners de este repositorio pueden tener
+# 'lmstudio' en la ruta. Cada muestra guarda CPU %, RSS e hilos de esos procesos, y la carga, memoria,
+# frecuencia y temperatura de la máquina, para cruzarlos con las latencias.
+
+PATRONES_LMSTUDIO = ("lm-studio", "/.lmstudio/")
+
+def buscar_procesos_lmstudio(patrones=PATRONES_LMSTUDIO):
+    propio = os.getpid()
+    procesos = []
+    for proceso in psutil.process_iter(["pid", "name", "cmdline"]):
+        try:
+            nombre = (proceso.info["name"] or "").lower()
+            texto = " ".join([nombre] + (proceso.info["cmdline"] or [])).lower()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        if proceso.info["pid"] == propio or nombre.startswith("python"):
+            continue
+        if any(patron in texto for patron in patrones):
+            procesos.append(proceso)
+    return procesos
+
+def temperatura_max():
+    # No disponible en todas las plataformas ni en máquinas virtuales
+    try:
+        sensores = psutil.sensors_temperatures()
+    except (AttributeError, OSError):
+        return None
+    lecturas = [s.current for grupo in sensores.values() for s in grupo if s.current]
+    return max(lecturas) if lecturas else None
+
+class MuestreadorRecursos:
+    def __init__(self, intervalo=0.5, patrones=PATRONES_LMSTUDIO, refresco_procesos=5.0):
+        self.intervalo = intervalo
+        self.patrones = patrones
+        self.refresco_procesos = refresco_procesos
+        self.muestras = []
+        self._procesos = {}
+        self._ultimo_refresco = None
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def _refrescar_procesos(self):
+        # Los procesos nuevos (p. ej. el worker de un modelo recién cargado) se añaden; los muertos se quitan
+        actuales = {p.pid: p for p in buscar_procesos_lmstudio(self.patrones)}
+        for pid, proceso in actuales.items():
+            if pid not in self._procesos:
+                try:
+                    proceso.cpu_percent(None)
+                except psutil.Error:
+                    continue
+                self._procesos[pid] = proceso
+        for pid in list(self._procesos):
+            if pid not in actuales:
+                del self._procesos[pid]
+        self._ultimo_refresco = time.monotonic()
+
+    def muestrear(self):
+        if self._ultimo_refresco is None or time.monotonic() - self._ultimo_refresco >= self.refresco_procesos:
+            self._refrescar_procesos()
+        cpu = rss = hilos = 0
+        for pid, proceso in list(self._procesos.items()):
+            try:
+                with proceso.oneshot():
+                    cpu += proceso.cpu_percent(None)
+                    rss += proceso.memory_info().rss
+                    hilos += proceso.num_threads()
+            except psutil.Error:
+                del self._procesos[pid]
+        memoria = psutil.virtual_memory()
+        frecuencia = psutil.cpu_freq()
+        muestra = {
+            "t": time.monotonic(),
+            "procesos": len(self._procesos),
+            "cpu_servidor": cpu,
+            "rss_servidor_mb": rss / 2**20,
+            "hilos_servidor": hilos,
+            "cpu_sistema": psutil.cpu_percent(None),
+            "carga_1m": os.getloadavg()[0] if hasattr(os, "getloadavg") else None,
+            "memoria_usada": memoria.percent,
+            "swap_usada": psutil.swap_memory().percent,
+            "frecuencia_cpu_mhz": frecuencia.current if frecuencia else None,
+            "temperatura_c": temperatura_max(),
+        }
+        self.muestras.append(muestra)
+        return muestra
+
+    def _bucle(self):
+        psutil.cpu_percent(None)
+        while not self._parar.wait(self.intervalo):
+            self.muestrear()
+
+    def iniciar(self):
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="muestreador_recursos", daemon=True)
+        self._hilo.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+        if self._hilo:
+            self._hilo.join()
+            self._hilo = None
+
+    def entre(self, inicio, fin):
+        """Resumen de las muestras tomadas en [inicio, fin] (reloj monotónico); si no hay ninguna,
+        la más cercana posterior. Máximos de CPU, RSS, hilos, carga y temperatura; mínimo de frecuencia."""
+        muestras = [m for m in self.muestras if inicio <= m["t"] <= fin + self.intervalo]
+        if not muestras:
+            posteriores = [m for m in self.muestras if m["t"] >= inicio]
+            muestras = posteriores[:1]
+        if not muestras:
+            return {}
+        def extremo(clave, funcion):
+            valores = [m[clave] for m in muestras if m[clave] is not None]
+            return funcion(valores) if valores else None
+        return {
+            "cpu_servidor": extremo("cpu_servidor", max),
+            "rss_servidor_mb": extremo("rss_servidor_mb", max),
+            "hilos_servidor": extremo("hilos_servidor", max),
+            "cpu_sistema": extremo("cpu_sistema", max),
+            "carga_1m": extremo("carga_1m", max),
+            "memoria_usada": extremo("memoria_usada", max),
+            "swap_usada": extremo("swap_usada", max),
+            "frecuencia_cpu_mhz": extremo("frecuencia_cpu_mhz", min),
+            "temperatura_c": extremo("temperatura_c", max),
+        }
+
+    def resumen(self):
+        if not self.muestras:
+            print("🖥️ Sin muestras de recursos.")
+            return
+        procesos = max(m["procesos"] for m in self.muestras)
+        cpu = max(m["cpu_servidor"] for m in self.muestras)
+        rss = max(m["rss_servidor_mb"] for m in self.muestras)
+        carga = [m["carga_1m"] for m in self.muestras if m["carga_1m"] is not None]
+        print(
+            f"🖥️ Recursos ({len(self.muestras)} muestras, {procesos} procesos de LM Studio): CPU máx {cpu:.0f}%, "
+            f"RSS máx {rss:.0f} MB" + (f", carga máx {max(carga):.2f}" if carga else "")
+        )
@@ -10,6 +10,10 @@ from openai import OpenAI
 import json
 from datetime import datetime
 from collections import deque
+from LLM_local_historial import HistorialJSONL, ruta_historial
+from LLM_local_dataset import listar_json_dataset, seleccionar_json, cargar_json
+from LLM_local_cassette import envolver
+from LLM_local_metricas import perfil
 
 LMSTUDIO_API_URL = "http://localhost:3000/v1/models"
 MODEL_NAME = ""
@@ -22,6 +26,7 @@ appimage_proc = None
 
 # Variable global para guardar el historial de mensajes
 messages = []
+historial = None  # HistorialJSONL, se abre en chat_local
 expended_times = []
 
 memory_limit = 6
@@ -29,62 +34,25 @@ messages_memory = deque(maxlen=memory_limit)
 
 model_name = ""
 
-# ------------------- NUEVO -------------------
-def listar_json_dataset():
-    dataset_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset")
-    if not os.path.exists(dataset_dir):
-        print(f"❌ No existe la carpeta: {dataset_dir}")
-        return []
-    archivos_json = [f for f in os.listdir(dataset_dir) if f.endswith(".json")]
-    return [os.path.join(dataset_dir, f) for f in archivos_json]
-
-def seleccionar_json():
-    archivos = listar_json_dataset()
-    if not archivos:
-        print("⚠️ No se encontraron archivos .json en la carpeta 'dataset'.")
-        return None
-    print("\n📂 Archivos JSON disponibles en 'dataset':")
-    for i, archivo in enumerate(archivos):
-        print(f"{i+1}. {os.path.basename(archivo)}")
-    while True:
-        try:
-            eleccion = int(input("\nElige un archivo (número, 0 para cancelar): "))
-            if eleccion == 0:
-                return None
-            if 1 <= eleccion <= len(archivos):
-                return archivos[eleccion - 1]
-            else:
-                print("❗ Opción fuera de rango.")
-        except ValueError:
-            print("❗ Introduce un número válido.")
-
-def cargar_json(ruta_json):
-    try:
-        with open(ruta_json, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if "messages" not in data or not isinstance(data["messages"], list):
-            raise ValueError("El JSON no contiene la clave 'messages' con una lista.")
-        return data["messages"]
-    except Exception as e:
-        print(f"❌ Error al leer el JSON: {e}")
-        return []
+# Cassette de respuestas en SQLite: "directo", "grabar" o "reproducir" (ver LLM_local_cassette.py)
+cassette_mode = "directo"
+cassette_path = None
+cassette_simulate_timing = False
 
-# Guardar historial en un JSON
+# Perfilado por etapas (ver LLM_local_metricas.py): se imprime y se vuelca junto al historial al terminar
+profiling = False
+
+# Cerrar el historial JSONL (los mensajes ya se han ido escribiendo durante la ejecución)
 def guardar_historial():
-    if not messages:
+    global historial
+    if historial is None:
         return
-    carpeta_historial = os.path.join(os.path.dirname(os.path.abspath(__file__)), "historial")
-    os.makedirs(carpeta_historial, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    ruta = os.path.join(carpeta_historial, f"historial_{timestamp}_memory_size_{memory_limit}_{model_name}.json")
     try:
-        for i, expended_time in enumerate(expended_times):
-            messages[i*2+1]["LLM_expended_time"] = expended_time
-        with open(ruta, "w", encoding="utf-8") as f:
-            json.dump({"messages": messages}, f, ensure_ascii=False, indent=2)
-        print(f"💾 Historial guardado en: {ruta}")
+        historial.cerrar()
+        print(f"💾 Historial guardado en: {historial.ruta}")
     except Exception as e:
         print(f"❌ Error al guardar historial: {e}")
+    historial = None
 
 # Handler para Ctrl+C
 def manejar_interrupcion(sig, frame):
@@ -127,8 +95,9 @@ def obtener_modelo_lanzado_lmstudio():
 
 
 def chat_local(modelo_seleccionado, mensajes_json=None):
-    global messages, expended_times
-    client = OpenAI(base_url="http://localhost:3000/v1", api_key="lm-studio")
+    global messages, expended_times, historial
+    client = envolver(OpenAI(base_url="http://localhost:3000/v1", api_key="lm-studio"),
+                      cassette_mode, cassette_path, cassette_simulate_timing)
 
     main_prompt = """
 Eres un robot social diseñado para seguir personas en un ámbito sociosanitario. Tus misiones son las siguientes:
@@ -140,6 +109,10 @@ Eres un robot social diseñado para seguir personas en un ámbito sociosanitario
         "role": "system",
         "content": main_prompt
     }]
+    historial = HistorialJSONL(ruta_historial(memory_limit, modelo_seleccionado))
+    historial.agregar(messages[0])
+    perfil.activo = profiling
+    perfil.reiniciar()
 
     expended_times = []
     if mensajes_json:
@@ -154,14 +127,16 @@ Eres un robot social diseñado para seguir personas en un ámbito sociosanitario
             """
             print(processed_dict)
 
-            messages.append({"role": "user", "content": developer_prompt.format(
-                lateral_distance=processed_dict["lateral_distance"],
-                frontal_distance=processed_dict["front_distance"]
-            )})
-            messages_memory.append({"role": "user", "content": developer_prompt.format(
+            mensaje_usuario = {"role": "user", "content": developer_prompt.format(
                 lateral_distance=processed_dict["lateral_distance"],
                 frontal_distance=processed_dict["front_distance"]
-            )})
+            )}
+            # La conversación completa solo se mantiene en memoria si se envía entera al modelo
+            if memory_limit <= 0:
+                messages.append(mensaje_usuario)
+            messages_memory.append(mensaje_usuario)
+            with perfil.tramo("historial"):
+                historial.agregar(mensaje_usuario, idx=idx)
 
             if len(messages_memory) == memory_limit:
                 messages_memory.popleft()
@@ -183,15 +158,25 @@ Eres un robot social diseñado para seguir personas en un ámbito sociosanitario
                         messages=messages,
                         temperature=0.7,
                     )
-                expended_milliseconds = time.time() - start
-                expended_times.append(expended_milliseconds)
+                expended_seconds = time.time() - start
+                perfil.registrar("peticion", expended_seconds)
+                expended_times.append(expended_seconds)
                 reply = completion.choices[0].message.content
                 print(f"[{idx+1}/{len(mensajes_json)}] 🤖 Respuesta: {reply}\n")
-                messages.append({"role": "assistant", "content": reply})
-                messages_memory.append({"role": "assistant", "content": reply})
+                mensaje_asistente = {"role": "assistant", "content": reply}
+                if memory_limit <= 0:
+                    messages.append(mensaje_asistente)
+                messages_memory.append(mensaje_asistente)
+                historial.agregar(mensaje_asistente, idx=idx, LLM_expended_time=expended_seconds)
             except Exception as e:
                 print("❌ Error al generar respuesta:", e)
                 break
+        if cassette_mode != "directo":
+            client.resumen()
+            client.cerrar()
+        if profiling:
+            perfil.resumen()
+            perfil.volcar(ruta_historial(memory_limit, modelo_seleccionado, "perfil.json"))
         guardar_historial()
     else:
         print("🤖 LLM Chat (escribe 'salir' para terminar)\n")
@@ -202,6 +187,7 @@ Eres un robot social diseñado para seguir personas en un ámbito sociosanitario
                 guardar_historial()
                 break
             messages.append({"role": "user", "content": user_input})
+            historial.agregar(messages[-1])
             try:
                 completion = client.chat.completions.create(
                     model=modelo_seleccionado,
@@ -211,6 +197,7 @@ Eres un robot social diseñado para seguir personas en un ámbito sociosanitario
                 reply = completion.choices[0].message.content
                 print(f"🤖 Asistente: {reply}\n")
                 messages.append({"role": "assistant", "content": reply})
+                historial.agregar(messages[-1])
             except Exception as e:
                 print("❌ Error al generar respuesta:", e)
                 break
@@ -6,16 +6,39 @@ import time
 import signal
 import sys
 import psutil
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import json
 import re
 from datetime import datetime
-from collections import deque
+from collections import deque, OrderedDict
 import math
 import copy
+import itertools
+import asyncio
+from dataclasses import dataclass
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from LLM_local_historial import HistorialJSONL, ruta_historial
+from LLM_local_prompts import MAIN_PROMPT
+from LLM_local_dataset import listar_json_dataset, seleccionar_json, cargar_json, iterar_muestras
+from LLM_local_endpoints import PoolEndpoints
+from LLM_local_cassette import envolver
+from LLM_local_ingesta import ColaMuestras, abrir_fuente
+from LLM_local_metricas import perfil, iniciar_servidor_metricas
 
 LMSTUDIO_API_URL = "http://192.168.50.37:3000/v1"
 # LMSTUDIO_API_URL = "http://localhost:3000/v1"
+# Pool de servidores: cada petición va al más rápido disponible y se reintenta en otro si falla.
+# None: solo LMSTUDIO_API_URL
+LMSTUDIO_API_URLS = None
+# LMSTUDIO_API_URLS = ["http://192.168.50.37:3000/v1", "http://localhost:3000/v1"]
+# Timeouts de cada petición en segundos: lectura (la inferencia en CPU puede ser lenta) y conexión (para
+# pasar pronto a otro servidor del pool); reintentos en el mismo servidor (None: 2 con un solo servidor)
+request_timeout = 600.0
+connect_timeout = 5.0
+request_retries = None
 MODEL_NAME = ""
 LMS_PATH = os.path.expanduser("~/.lmstudio/bin/lms")
 
@@ -25,12 +48,13 @@ appimage_proc = None
 
 # Variable global para guardar el historial de mensajes
 messages = []
-total_messages = []
+historial = None  # HistorialJSONL, se abre en chat_local
 expended_times = []
+estadisticas_ejecucion = {}
 
 memory_limit = 5
 memory_sliding_window_size = 1
-messages_memory = deque(maxlen=memory_limit)
+messages_memory = None  # VentanaTemporal, se crea en chat_local
 # model_name = "qwen/qwen3-8b"
 
 
@@ -38,65 +62,99 @@ model_name = "openai/gpt-oss-20b"
 
 last_answer = None
 
-# ------------------- NUEVO -------------------
-def listar_json_dataset():
-    dataset_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset")
-    if not os.path.exists(dataset_dir):
-        print(f"❌ No existe la carpeta: {dataset_dir}")
-        return []
-    archivos_json = [f for f in os.listdir(dataset_dir) if f.endswith(".json")]
-    return [os.path.join(dataset_dir, f) for f in archivos_json]
-
-def seleccionar_json():
-    archivos = listar_json_dataset()
-    if not archivos:
-        print("⚠️ No se encontraron archivos .json en la carpeta 'dataset'.")
-        return None
-    print("\n📂 Archivos JSON disponibles en 'dataset':")
-    for i, archivo in enumerate(archivos):
-        print(f"{i+1}. {os.path.basename(archivo)}")
-    while True:
-        try:
-            eleccion = int(input("\nElige un archivo (número, 0 para cancelar): "))
-            if eleccion == 0:
-                return None
-            if 1 <= eleccion <= len(archivos):
-                return archivos[eleccion - 1]
-            else:
-                print("❗ Opción fuera de rango.")
-        except ValueError:
-            print("❗ Introduce un número válido.")
+# Reproducción en tiempo real sobre el reloj 'time_mission_start' del dataset (replay_speed > 1 acelera)
+realtime_replay = False
+replay_speed = 1.0
 
-def cargar_json(ruta_json):
-    try:
-        with open(ruta_json, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if "messages" not in data or not isinstance(data["messages"], list):
-            raise ValueError("El JSON no contiene la clave 'messages' con una lista.")
-        return data["messages"]
-    except Exception as e:
-        print(f"❌ Error al leer el JSON: {e}")
-        return []
+# Filtro numérico previo al LLM: "off" (sin filtro), "on" (solo se llama al modelo si hay algún disparador)
+# o "shadow" (se llama siempre y se mide la concordancia entre filtro y LLM)
+gate_mode = "off"
+gate_distance_jump = 0.3
+gate_distance_limit = 2.7
+gate_heartbeat_seconds = 5.0
+
+# Modo pipeline online: las muestras llegan sobre el reloj de reproducción y la petición en curso no se
+# interrumpe mientras su TTS pueda llegar a tiempo; las ventanas que llegan mientras tanto esperan y solo
+# se envía la más reciente (gana la última). Nunca se dice un TTS cuyos datos tengan más de 'max_tts_age'
+# segundos; con cancel_superseded, una petición que ya no puede cumplirlo se cancela al llegar otra muestra
+pipeline_mode = False
+cancel_superseded = True
+max_tts_age = 3.0
+
+# Streaming: el TTS se entrega en cuanto se cierra su cadena, sin esperar al resto del diccionario
+use_streaming = True
+
+# Salida estructurada: se envía el esquema del diccionario en 'response_format' y se limita la longitud
+structured_output = True
+max_reply_tokens = 200
+include_reasoning = True
+reasoning_max_chars = 300
+max_parse_retries = 1
+
+# Disposición del prompt: "ventana" (la ventana completa en un único mensaje, cambia en cada paso) o
+# "multiturno" (conversación que solo crece, con una muestra nueva por turno, y que se reinicia cada
+# 'multiturn_reset_turns' turnos). La segunda mantiene estable el prefijo para la caché KV del servidor.
+prompt_layout = "ventana"
+multiturn_reset_turns = 8
+
+# Codificación de cada muestra en el prompt: "verboso" (frases en castellano), "csv" (tabla compacta con
+# cabecera) o "delta" (tabla con distancias como variación y campos repetidos marcados con '=')
+sample_encoding = "verboso"
+
+# Ventana adaptativa: ajusta el número de muestras entre window_min y window_max para que el p95 de la
+# latencia se mantenga por debajo de latency_slo_p95 segundos
+adaptive_window = False
+window_min = 2
+window_max = 10
+latency_slo_p95 = 2.0
+
+# Estrategia de ventana: "muestras" (las últimas memory_limit muestras) o "tiempo" (las muestras de los
+# últimos window_seconds segundos). Con window_keyframes se quitan las muestras casi idénticas a la anterior
+# conservada (distancia, orientación, estancia, affordance e intenciones sin cambios apreciables)
+window_strategy = "muestras"
+window_seconds = 6.0
+window_keyframes = False
+keyframe_distance = 0.15
+keyframe_orientation = 0.3
+
+# Caché de respuestas por ventana resumida: mismas secuencias de bandas de distancia (cache_distance_step, y
+# una sola banda por encima de gate_distance_limit), de estancias y de affordances, mismas clases de orientación
+# e intenciones; los tiempos no cuentan. Solo se guardan las respuestas sin TTS (silencios), que se reutilizan
+response_cache = False
+cache_distance_step = 0.5
+cache_size = 256
+cache_ttl = 30.0
 
-# Guardar historial en un JSON
+# Cassette de respuestas en SQLite: "directo" (siempre al modelo), "grabar" (al modelo y se guarda)
+# o "reproducir" (desde el disco, sin modelo). None: cassettes/cassette.sqlite
+cassette_mode = "directo"
+cassette_path = None
+cassette_simulate_timing = False
+
+# Ingesta en vivo (--en-vivo): muestras JSON línea a línea desde un socket local ("tcp://host:puerto")
+# o una tubería/fichero ("-" para la entrada estándar), en una cola acotada de ingest_queue_size muestras.
+# Si el LLM va por detrás: "descartar_antiguas" o "fusionar" (ver LLM_local_ingesta.py)
+live_ingest_source = "tcp://127.0.0.1:5555"
+ingest_queue_size = 8
+ingest_policy = "descartar_antiguas"
+
+# Perfilado por etapas (codificación, ventana, petición, parseo, historial...): histogramas que se
+# imprimen y se vuelcan junto al historial al terminar; con profiling_port, también en /metrics
+profiling = False
+profiling_port = None
+_servidor_metricas = None
+
+# Cerrar el historial JSONL (los mensajes ya se han ido escribiendo durante la ejecución)
 def guardar_historial():
-    if not total_messages:
+    global historial
+    if historial is None:
         return
-    carpeta_historial = os.path.join(os.path.dirname(os.path.abspath(__file__)), "historial")
-    os.makedirs(carpeta_historial, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    ruta = os.path.join(
-        carpeta_historial,
-        f"historial_{timestamp}_memory_size_{memory_limit}_{model_name.replace('/', '-')}.json"
-    )
     try:
-        # for i, expended_time in enumerate(expended_times):
-        #     messages[i]["LLM_expended_time"] = expended_time
-        with open(ruta, "w", encoding="utf-8") as f:
-            json.dump({"messages": total_messages}, f, ensure_ascii=False, indent=2)
-        print(f"💾 Historial guardado en: {ruta}")
+        historial.cerrar()
+        print(f"💾 Historial guardado en: {historial.ruta}")
     except Exception as e:
         print(f"❌ Error al guardar historial: {e}")
+    historial = None
 
 # Handler para Ctrl+C
 def manejar_interrupcion(sig, frame):
@@ -106,17 +164,23 @@ def manejar_interrupcion(sig, frame):
 
 signal.signal(signal.SIGINT, manejar_interrupcion)
 
+_pool = None
+
+def obtener_pool():
+    """Pool de endpoints compartido entre ejecuciones; se recrea si cambia la configuración de URLs."""
+    global _pool
+    urls = list(LMSTUDIO_API_URLS or [LMSTUDIO_API_URL])
+    if _pool is None or [e.url for e in _pool.endpoints] != urls:
+        _pool = PoolEndpoints(urls, timeout=request_timeout, timeout_conexion=connect_timeout, reintentos=request_retries)
+    return _pool
+
 def esperar_api(timeout=60):
     print("⏳ Esperando a que la API de LM Studio esté disponible...")
     inicio = time.time()
     while time.time() - inicio < timeout:
-        try:
-            r = requests.get(LMSTUDIO_API_URL)
-            if r.status_code == 200:
-                print("✅ LM Studio API está activa.")
-                return True
-        except requests.exceptions.ConnectionError:
-            pass
+        if obtener_pool().comprobar_salud():
+            print("✅ LM Studio API está activa.")
+            return True
         time.sleep(1)
     print("❌ Timeout: la API de LM Studio no respondió.")
     return False
@@ -137,116 +201,800 @@ def obtener_modelo_lanzado_lmstudio():
         print("❌ Error al obtener la lista de modelos:", e.stderr)
         return None
 
+# Extrae el valor de una clave del diccionario de respuesta a medida que llegan los tokens
+class ExtractorJSONIncremental:
+    def __init__(self, clave="TTS"):
+        self.clave = clave
+        self.valor = None
+        self._pila = []
+        self._en_cadena = False
+        self._escape = False
+        self._es_clave = False
+        self._esperando_clave = False
+        self._cadena = []
+        self._ultima_clave = None
+
+    def alimentar(self, fragmento):
+        """Procesa un fragmento de texto. Devuelve el valor de la clave la primera vez que se completa."""
+        encontrado = None
+        for ch in fragmento:
+            if self._en_cadena:
+                if self._escape:
+                    self._cadena.append(ch)
+                    self._escape = False
+                elif ch == "\\":
+                    self._cadena.append(ch)
+                    self._escape = True
+                elif ch == '"':
+                    self._en_cadena = False
+                    valor = self._cerrar_cadena()
+                    if valor is not None:
+                        encontrado = valor
+                else:
+                    self._cadena.append(ch)
+            elif not self._pila:
+                # Todo lo anterior al primer '{' (p. ej. texto libre del modelo) se ignora
+                if ch == "{":
+                    self._pila.append(ch)
+                    self._esperando_clave = True
+            elif ch == '"':
+                self._en_cadena = True
+                self._es_clave = len(self._pila) == 1 and self._esperando_clave
+                self._cadena = []
+            elif ch in "{[":
+                self._pila.append(ch)
+            elif ch in "}]":
+                self._pila.pop()
+            elif ch == ":" and len(self._pila) == 1:
+                self._esperando_clave = False
+            elif ch == "," and len(self._pila) == 1:
+                self._esperando_clave = True
+        return encontrado
+
+    def _cerrar_cadena(self):
+        try:
+            texto = json.loads('"' + "".join(self._cadena) + '"')
+        except json.JSONDecodeError:
+            texto = "".join(self._cadena)
+        if self._es_clave:
+            self._ultima_clave = texto
+        elif len(self._pila) == 1 and self._ultima_clave == self.clave and self.valor is None:
+            self.valor = texto
+            return texto
+        return None
+
+def emitir_tts(texto):
+    # Punto de enganche con el TTS del robot
+    if texto:
+        print(f"🔊 TTS: {texto}")
+
+@dataclass
+class RespuestaShadow:
+    reasoning: str
+    TTS: str
+    time_next_inference: float
+
+    @classmethod
+    def desde_texto(cls, texto):
+        """Valida la respuesta del modelo. Lanza ValueError si no es un diccionario válido."""
+        texto = texto or ""
+        try:
+            datos = json.loads(texto)
+        except json.JSONDecodeError:
+            match = re.search(r'\{[\s\S]*\}', texto, re.DOTALL)
+            if not match:
+                raise ValueError("No se encontró JSON en el texto.")
+            try:
+                datos = json.loads(match.group())
+            except json.JSONDecodeError as e:
+                raise ValueError(f"JSON mal formado: {e}")
+        if not isinstance(datos, dict) or not isinstance(datos.get("TTS"), str):
+            raise ValueError("La respuesta no contiene la clave 'TTS'.")
+        try:
+            espera = float(datos.get("time_next_inference", 0))
+        except (TypeError, ValueError):
+            raise ValueError(f"'time_next_inference' no es numérico: {datos.get('time_next_inference')!r}")
+        return cls(str(datos.get("reasoning", "")), datos["TTS"], espera)
+
+def esquema_respuesta():
+    propiedades = {
+        "TTS": {"type": "string"},
+        "time_next_inference": {"type": "number", "minimum": 0},
+    }
+    if include_reasoning:
+        propiedades = {"reasoning": {"type": "string", "maxLength": reasoning_max_chars}, **propiedades}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "shadow_reply",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": propiedades,
+                "required": list(propiedades),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+def parametros_peticion():
+    """Parámetros extra de la petición según el modo de salida configurado."""
+    if not structured_output:
+        return {}
+    return {"response_format": esquema_respuesta(), "max_tokens": max_reply_tokens}
+
+def tokens_en_cache(usage):
+    # Solo algunos servidores informan de los tokens del prompt servidos desde la caché
+    detalles = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return getattr(detalles, "cached_tokens", None) if detalles else None
+
+def completar_streaming(client, modelo_seleccionado, messages, temperature=0.5, hablar=True):
+    """Lanza la petición en streaming y emite el TTS en cuanto está disponible (si 'hablar').
+    Devuelve la respuesta completa y sus métricas: tiempos (total, primer token y TTS) en segundos y tokens."""
+    extractor = ExtractorJSONIncremental("TTS")
+    partes = []
+    metricas = {"total": None, "ttft": None, "tts": None, "prompt_tokens": None, "completion_tokens": None, "cached_tokens": None}
+    # Instante de inicio en reloj monotónico, para cruzar la petición con el muestreo de recursos
+    metricas["inicio"] = time.monotonic()
+    start = time.time()
+    stream = client.chat.completions.create(
+        model=modelo_seleccionado,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        stream_options={"include_usage": True},
+        **parametros_peticion(),
+    )
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            metricas["prompt_tokens"] = chunk.usage.prompt_tokens
+            metricas["completion_tokens"] = chunk.usage.completion_tokens
+            metricas["cached_tokens"] = tokens_en_cache(chunk.usage)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if metricas["ttft"] is None:
+            metricas["ttft"] = time.time() - start
+        partes.append(delta)
+        tts = extractor.alimentar(delta)
+        if tts is not None and metricas["tts"] is None:
+            metricas["tts"] = time.time() - start
+            if hablar:
+                emitir_tts(tts)
+    metricas["total"] = time.time() - start
+    return "".join(partes), metricas
+
+def solicitar_respuesta(client, modelo_seleccionado, messages, temperature=0.5, hablar=True):
+    # 'hablar' solo afecta al streaming; sin streaming el TTS se emite tras validar la respuesta
+    if use_streaming:
+        return completar_streaming(client, modelo_seleccionado, messages, temperature, hablar)
+    inicio = time.monotonic()
+    start = time.time()
+    completion = client.chat.completions.create(
+        model=modelo_seleccionado,
+        messages=messages,
+        temperature=temperature,
+        **parametros_peticion(),
+    )
+    total = time.time() - start
+    usage = completion.usage
+    # Sin streaming no hay primer token ni TTS adelantado: solo se conoce el total
+    return completion.choices[0].message.content, {
+        "total": total, "ttft": None, "tts": None,
+        "prompt_tokens": usage.prompt_tokens if usage else None,
+        "completion_tokens": usage.completion_tokens if usage else None,
+        "cached_tokens": tokens_en_cache(usage),
+        "inicio": inicio,
+    }
+
+# Detecta en los datos crudos los mismos casos que describe el prompt de sistema
+class FiltroCambios:
+    def __init__(self, salto_distancia=0.3, distancia_limite=2.7, heartbeat=5.0):
+        self.salto_distancia = salto_distancia
+        self.distancia_limite = distancia_limite
+        self.heartbeat = heartbeat
+        self.anterior = None
+        self.ultima_llamada = None
+        self.muestras = 0
+        self.llamadas = 0
+        # Concordancia filtro/LLM: (filtro dispara, LLM genera TTS) -> número de casos
+        self.concordancia = {(True, True): 0, (True, False): 0, (False, True): 0, (False, False): 0}
+
+    def evaluar(self, msg):
+        """Devuelve la lista de disparadores activos para la muestra."""
+        self.muestras += 1
+        disparadores = []
+        x, y = msg.get("distance", (0.0, 0.0))
+        distancia = math.hypot(x, y)
+        angulo = (msg.get("orientation", 0.0) + math.pi) % (2 * math.pi) - math.pi
+        if self.anterior is None:
+            disparadores.append("inicio")
+        else:
+            xa, ya = self.anterior.get("distance", (0.0, 0.0))
+            if distancia - math.hypot(xa, ya) > self.salto_distancia:
+                disparadores.append("salto_distancia")
+            if msg.get("actual_room_name") != self.anterior.get("actual_room_name"):
+                disparadores.append("cambio_estancia")
+            if set(msg.get("intention_targets", [])) - set(self.anterior.get("intention_targets", [])):
+                disparadores.append("nueva_intencion")
+        if distancia >= self.distancia_limite:
+            disparadores.append("distancia_limite")
+        if abs(angulo) > 5 * math.pi / 6:
+            disparadores.append("mirando_al_robot")
+        t = msg.get("time_mission_start")
+        if (not disparadores and self.heartbeat and self.ultima_llamada is not None
+                and t is not None and t - self.ultima_llamada >= self.heartbeat):
+            disparadores.append("heartbeat")
+        self.anterior = msg
+        return disparadores
+
+    def registrar_llamada(self, t):
+        self.llamadas += 1
+        self.ultima_llamada = t
+
+    def registrar_respuesta(self, disparadores, tts):
+        # El heartbeat no cuenta como predicción del filtro
+        predice = any(d != "heartbeat" for d in disparadores)
+        self.concordancia[(predice, bool(tts))] += 1
+
+    def resumen(self):
+        evaluadas = sum(self.concordancia.values())
+        aciertos = self.concordancia[(True, True)] + self.concordancia[(False, False)]
+        resumen = {
+            "muestras": self.muestras,
+            "llamadas": self.llamadas,
+            "reduccion_llamadas": 1 - self.llamadas / self.muestras if self.muestras else 0.0,
+            "concordancia": aciertos / evaluadas if evaluadas else None,
+            "falsos_negativos": self.concordancia[(False, True)],
+            "falsos_positivos": self.concordancia[(True, False)],
+        }
+        texto_concordancia = f"{resumen['concordancia']:.0%}" if evaluadas else "n/d"
+        print(
+            f"🚦 Filtro: {resumen['llamadas']}/{resumen['muestras']} llamadas "
+            f"(reducción {resumen['reduccion_llamadas']:.0%}), concordancia con el LLM {texto_concordancia} "
+            f"({resumen['falsos_negativos']} avisos no detectados, {resumen['falsos_positivos']} disparos sin aviso)"
+        )
+        return resumen
+
+# Reproduce el dataset respetando su reloj y el 'time_next_inference' pedido por el modelo
+class PlanificadorTiempoReal:
+    def __init__(self, t0_mision, velocidad=1.0):
+        self.t0_mision = t0_mision
+        self.velocidad = velocidad
+        self.inicio_real = time.monotonic()
+        self.proxima_inferencia = t0_mision
+        self.inferencias = 0
+        self.omitidas_espera = 0
+        self.descartadas_obsoletas = 0
+        self.deadlines_perdidos = 0
+        self.retrasos = []
+
+    def reloj(self):
+        """Tiempo de misión simulado en segundos."""
+        return self.t0_mision + (time.monotonic() - self.inicio_real) * self.velocidad
+
+    def esperar_muestra(self, t_muestra):
+        restante = (t_muestra - self.reloj()) / self.velocidad
+        if restante > 0:
+            time.sleep(restante)
+
+    def decidir(self, t_muestra, t_siguiente=None):
+        """Devuelve True si hay que lanzar inferencia sobre esta muestra."""
+        # Si la siguiente muestra ya ha llegado mientras terminaba la inferencia anterior, esta está obsoleta
+        if t_siguiente is not None and self.reloj() >= t_siguiente:
+            self.descartadas_obsoletas += 1
+            return False
+        if t_muestra < self.proxima_inferencia:
+            self.omitidas_espera += 1
+            return False
+        return True
+
+    def registrar(self, t_muestra, t_siguiente=None, time_next_inference=None):
+        ahora = self.reloj()
+        self.inferencias += 1
+        self.retrasos.append(ahora - t_muestra)
+        if t_siguiente is not None and ahora > t_siguiente:
+            self.deadlines_perdidos += 1
+        try:
+            espera = max(float(time_next_inference), 0.0)
+        except (TypeError, ValueError):
+            espera = 0.0
+        self.proxima_inferencia = t_muestra + espera
+
+    def resumen(self):
+        retrasos = sorted(self.retrasos)
+        resumen = {
+            "inferencias": self.inferencias,
+            "omitidas_por_time_next_inference": self.omitidas_espera,
+            "descartadas_obsoletas": self.descartadas_obsoletas,
+            "deadlines_perdidos": self.deadlines_perdidos,
+            "retraso_medio": sum(retrasos) / len(retrasos) if retrasos else 0.0,
+            "retraso_max": retrasos[-1] if retrasos else 0.0,
+        }
+        print(
+            f"🕒 Tiempo real x{self.velocidad}: {resumen['inferencias']} inferencias, "
+            f"{resumen['omitidas_por_time_next_inference']} omitidas por espera, "
+            f"{resumen['descartadas_obsoletas']} obsoletas, {resumen['deadlines_perdidos']} deadlines perdidos, "
+            f"retraso medio {resumen['retraso_medio']:.2f}s (máx {resumen['retraso_max']:.2f}s)"
+        )
+        return resumen
+
+
+# Ventana deslizante de líneas ya renderizadas: coste constante por paso
+class VentanaTemporal:
+    def __init__(self, maxlen, cabecera=None):
+        self.lineas = deque(maxlen=maxlen)
+        # Versión autocontenida de cada línea, para cuando queda la primera de la ventana
+        self.iniciales = deque(maxlen=maxlen)
+        # Muestras originales, para la clave de la caché de respuestas
+        self.muestras = deque(maxlen=maxlen)
+        self.cabecera = cabecera
+        # Muestras que se envían (las últimas); puede reducirse por debajo de maxlen sin perder las guardadas
+        self.capacidad = maxlen
+
+    def __len__(self):
+        return len(self.lineas)
+
+    def agregar(self, linea, linea_inicial=None, msg=None, idx=None):
+        self.lineas.append(linea)
+        self.iniciales.append(linea if linea_inicial is None else linea_inicial)
+        self.muestras.append(msg)
+
+    def muestras_enviadas(self):
+        inicio = max(len(self.muestras) - self.capacidad, 0)
+        return list(itertools.islice(self.muestras, inicio, None))
+
+    def prompt(self):
+        # Mismo texto que el f-string original, construido con un único join
+        if not self.lineas or not self.capacidad:
+            return "\n\n                "
+        inicio = max(len(self.lineas) - self.capacidad, 0)
+        if self.cabecera is None and inicio == 0 and self.iniciales[0] is self.lineas[0]:
+            return "\n".join(("", *self.lineas, "                "))
+        cabecera = (self.cabecera,) if self.cabecera else ()
+        return "\n".join((
+            "", *cabecera, self.iniciales[inicio], *itertools.islice(self.lineas, inicio + 1, None), "                "
+        ))
+
+    def mensajes(self):
+        return [SYSTEM_MESSAGE, {"role": "user", "content": self.prompt()}]
+
+def es_casi_duplicado(msg, referencia):
+    """True si la muestra apenas cambia respecto a la referencia en lo que describe el prompt."""
+    x, y = msg.get("distance", (0.0, 0.0))
+    xr, yr = referencia.get("distance", (0.0, 0.0))
+    giro = (msg.get("orientation", 0.0) - referencia.get("orientation", 0.0) + math.pi) % (2 * math.pi) - math.pi
+    return (
+        math.hypot(x - xr, y - yr) < keyframe_distance
+        and abs(giro) < keyframe_orientation
+        and all(abs(a - b) < 0.05 for a, b in zip(msg.get("robot_speed", (0.0, 0.0)), referencia.get("robot_speed", (0.0, 0.0))))
+        and msg.get("actual_room_name") == referencia.get("actual_room_name")
+        and msg.get("robot_submissions") == referencia.get("robot_submissions")
+        and set(msg.get("intention_targets") or []) == set(referencia.get("intention_targets") or [])
+    )
+
+# Ventana por tiempo: muestras de los últimos 'segundos', opcionalmente reducidas a fotogramas clave
+class VentanaPorTiempo(VentanaTemporal):
+    def __init__(self, segundos, keyframes=False, cabecera=None, maxlen=None):
+        super().__init__(maxlen, cabecera)
+        self.capacidad = maxlen or math.inf
+        self.segundos = segundos
+        self.keyframes = keyframes
+        # (idx, tiempo, muestra, línea incremental, línea completa)
+        self.entradas = deque()
+        self.descartadas_keyframe = 0
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def agregar(self, linea, linea_inicial=None, msg=None, idx=None):
+        t = msg['time_mission_start']
+        # La última muestra siempre se envía; cuando llega otra, se quita si no aportaba cambios
+        if self.keyframes and len(self.entradas) >= 2 and es_casi_duplicado(self.entradas[-1][2], self.entradas[-2][2]):
+            self.entradas.pop()
+            self.descartadas_keyframe += 1
+        self.entradas.append((idx, t, msg, linea, linea if linea_inicial is None else linea_inicial))
+        while t - self.entradas[0][1] > self.segundos:
+            self.entradas.popleft()
+        while len(self.entradas) > self.capacidad:
+            self.entradas.popleft()
+
+    def prompt(self):
+        if not self.entradas:
+            return "\n\n                "
+        lineas = []
+        idx_anterior = None
+        for idx, _, _, linea, completa in self.entradas:
+            # La línea incremental solo vale si la fila anterior es la muestra inmediatamente anterior
+            lineas.append(linea if idx_anterior is not None and idx == idx_anterior + 1 else completa)
+            idx_anterior = idx
+        cabecera = (self.cabecera,) if self.cabecera else ()
+        return "\n".join(("", *cabecera, *lineas, "                "))
+
+    def muestras_enviadas(self):
+        return [entrada[2] for entrada in self.entradas]
+
+def crear_ventana():
+    """Ventana según la configuración: por muestras (fija o adaptativa) o por tiempo."""
+    cabecera = CODIFICADORES[sample_encoding].cabecera
+    if window_strategy == "tiempo":
+        return VentanaPorTiempo(window_seconds, window_keyframes, cabecera)
+    ventana = VentanaTemporal(max(memory_limit, window_max) if adaptive_window else memory_limit, cabecera)
+    if adaptive_window:
+        ventana.capacidad = min(max(memory_limit, window_min), window_max)
+    return ventana
+
+# Caché LRU con caducidad de respuestas, indexada por la forma cuantizada de la ventana
+class CacheRespuestas:
+    def __init__(self, capacidad=256, ttl=30.0, paso_distancia=0.5, limite_distancia=2.7):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.paso_distancia = paso_distancia
+        self.limite_distancia = limite_distancia
+        self.entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.caducadas = 0
+
+    @staticmethod
+    def clase_orientacion(angulo):
+        """Las cuatro clases de describe_state, sin los radianes."""
+        angulo = (angulo + math.pi) % (2 * math.pi) - math.pi
+        if abs(angulo) < math.pi / 6:
+            return "mismo sentido"
+        if abs(angulo) > 5 * math.pi / 6:
+            return "mirando al robot"
+        return "izquierda" if angulo > 0 else "derecha"
+
+    def _banda(self, distancia):
+        # Por encima del límite de distancia del prompt todas las distancias son la misma banda
+        return "lejos" if distancia > self.limite_distancia else round(distancia / self.paso_distancia)
+
+    def clave(self, muestras):
+        """Resumen de la ventana: secuencia de bandas de distancia, de estancias y de affordances (sin
+        repeticiones consecutivas), clases de orientación e intenciones vistas en ella. Los tiempos y las
+        oscilaciones dentro de una banda no cambian la clave; un cambio de estancia o una muestra mirando
+        al robot dentro de la ventana, sí."""
+        if not muestras:
+            return None
+        def secuencia(valores):
+            return tuple(valor for valor, _ in itertools.groupby(valores))
+        return (
+            secuencia(self._banda(math.hypot(*(msg.get("distance") or (0.0, 0.0)))) for msg in muestras),
+            secuencia(msg.get("actual_room_name") for msg in muestras),
+            secuencia(json.dumps(msg.get("robot_submissions"), ensure_ascii=False) for msg in muestras),
+            tuple(sorted({self.clase_orientacion(msg["orientation"]) for msg in muestras if "orientation" in msg})),
+            tuple(sorted({objetivo for msg in muestras for objetivo in msg.get("intention_targets") or []})),
+        )
+
+    def obtener(self, clave):
+        entrada = self.entradas.get(clave)
+        if entrada is not None and time.monotonic() - entrada[0] > self.ttl:
+            del self.entradas[clave]
+            self.caducadas += 1
+            entrada = None
+        if entrada is None:
+            self.fallos += 1
+            return None
+        self.entradas.move_to_end(clave)
+        self.aciertos += 1
+        return entrada[1]
+
+    def guardar(self, clave, reply):
+        self.entradas[clave] = (time.monotonic(), reply)
+        self.entradas.move_to_end(clave)
+        while len(self.entradas) > self.capacidad:
+            self.entradas.popitem(last=False)
+
+    def resumen(self):
+        consultas = self.aciertos + self.fallos
+        resumen = {
+            "aciertos": self.aciertos, "fallos": self.fallos, "caducadas": self.caducadas,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+        }
+        print(
+            f"🗃️ Caché de respuestas: {self.aciertos}/{consultas} aciertos ({resumen['tasa_aciertos']:.0%}), "
+            f"{self.caducadas} caducadas, {len(self.entradas)} entradas"
+        )
+        return resumen
+
+# Ajusta el tamaño de la ventana según la latencia observada y los tokens estimados por muestra
+class ControladorVentana:
+    def __init__(self, minimo, maximo, slo_p95, muestras_latencia=20, enfriamiento=3):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.slo_p95 = slo_p95
+        self.enfriamiento = enfriamiento
+        self.latencias = deque(maxlen=muestras_latencia)
+        self.tokens_base = None
+        self.tokens_por_muestra = None
+        self.desde_ajuste = 0
+        self.ajustes = []
+
+    def tokens_estimados(self, n):
+        if self.tokens_base is None or self.tokens_por_muestra is None:
+            return None
+        return self.tokens_base + n * self.tokens_por_muestra
+
+    def _actualizar_tokens(self, prompt_tokens, n):
+        if not prompt_tokens or not n:
+            return
+        if self.tokens_base is None:
+            self.tokens_base = contar_tokens_aprox(MAIN_PROMPT)
+        por_muestra = max(prompt_tokens - self.tokens_base, 1) / n
+        self.tokens_por_muestra = por_muestra if self.tokens_por_muestra is None else 0.3 * por_muestra + 0.7 * self.tokens_por_muestra
+
+    def p95(self):
+        valores = sorted(self.latencias)
+        return valores[min(int(round(0.95 * (len(valores) - 1))), len(valores) - 1)] if valores else None
+
+    def registrar(self, latencia, prompt_tokens, n):
+        """Registra una petición con ventana de n muestras. Devuelve el nuevo tamaño si hay que cambiarlo."""
+        self.latencias.append(latencia)
+        self._actualizar_tokens(prompt_tokens, n)
+        self.desde_ajuste += 1
+        if self.desde_ajuste < self.enfriamiento:
+            return None
+        p95 = self.p95()
+        nuevo = None
+        if p95 > self.slo_p95 and n > self.minimo:
+            nuevo, motivo = n - 1, "p95 por encima del objetivo"
+        elif n < self.maximo:
+            # Solo se crece si la latencia prevista con una muestra más sigue con margen bajo el objetivo
+            actuales, siguientes = self.tokens_estimados(n), self.tokens_estimados(n + 1)
+            prevista = p95 * siguientes / actuales if actuales and siguientes else p95
+            if prevista < 0.8 * self.slo_p95:
+                nuevo, motivo = n + 1, "margen bajo el objetivo"
+        if nuevo is None:
+            return None
+        self.desde_ajuste = 0
+        # Las latencias medidas con el tamaño anterior ya no son representativas
+        self.latencias.clear()
+        ajuste = {"de": n, "a": nuevo, "p95": p95, "tokens_estimados": self.tokens_estimados(nuevo), "motivo": motivo}
+        self.ajustes.append(ajuste)
+        tokens = f"~{ajuste['tokens_estimados']:.0f} tokens" if ajuste["tokens_estimados"] else "tokens n/d"
+        print(f"📐 Ventana {n} → {nuevo} muestras ({motivo}: p95 {p95:.2f}s, objetivo {self.slo_p95:.2f}s, {tokens})")
+        return nuevo
+
+def contar_tokens_aprox(texto):
+    # ~4 caracteres por token: suficiente para repartir los tokens del prompt entre sistema y muestras
+    return max(1, len(texto) // 4)
+
+# Conversación multiturno que solo crece: cada petición repite exactamente la anterior como prefijo
+class ConversacionIncremental:
+    def __init__(self, reinicio_turnos=8):
+        self.reinicio_turnos = reinicio_turnos
+        self.mensajes_conversacion = []
+        self.pendientes = []
+        self.turnos = 0
+
+    def agregar(self, linea):
+        self.pendientes.append(linea)
+
+    def mensajes(self, ventana):
+        if not self.mensajes_conversacion or self.turnos >= self.reinicio_turnos:
+            # Reinicio: se parte de la ventana actual completa para no perder contexto
+            self.mensajes_conversacion = [SYSTEM_MESSAGE, {"role": "user", "content": ventana.prompt()}]
+            self.turnos = 0
+        else:
+            contenido = "\n".join(("", *self.pendientes, "                "))
+            self.mensajes_conversacion.append({"role": "user", "content": contenido})
+        self.pendientes = []
+        self.turnos += 1
+        return list(self.mensajes_conversacion)
+
+    def registrar_respuesta(self, reply):
+        if self.mensajes_conversacion and self.mensajes_conversacion[-1]["role"] == "user":
+            self.mensajes_conversacion.append({"role": "assistant", "content": reply})
+
+def longitud_prefijo_comun(anteriores, actuales):
+    """Caracteres del prompt que coinciden con la petición anterior (lo reutilizable por la caché de prefijo)."""
+    if not anteriores:
+        return 0
+    texto_anterior = "".join(m["content"] for m in anteriores)
+    texto_actual = "".join(m["content"] for m in actuales)
+    return len(os.path.commonprefix([texto_anterior, texto_actual]))
+
+# Mensaje de sistema compartido: se reutiliza el mismo dict en cada petición y en el historial
+SYSTEM_MESSAGE = {"role": "system", "content": MAIN_PROMPT}
+
+
+def activar_perfilado():
+    global _servidor_metricas
+    perfil.activo = profiling
+    perfil.reiniciar()
+    if profiling and profiling_port is not None and _servidor_metricas is None:
+        _servidor_metricas = iniciar_servidor_metricas(profiling_port)
+
+def volcar_perfilado(modelo_seleccionado):
+    if profiling:
+        perfil.resumen()
+        perfil.volcar(ruta_historial(memory_limit, modelo_seleccionado, "perfil.json"))
 
 def chat_local(modelo_seleccionado, mensajes_json=None):
-    global messages, expended_times, last_answer
-    client = OpenAI(base_url=LMSTUDIO_API_URL, api_key="lm-studio")
-
-    main_prompt = """
-- Descripción:
-Eres Shadow, un robot social cuya misión es navegar siguiendo a personas. Debes generar una respuesta en castellano hacia a la persona que tú estás siguiendo. Esta respuesta tiene la finalidad de alterar el comportamiento de la persona con el objetivo de mejorar la experiencia del seguimiento. 
-- Procedimiento:
-1. Analizar la serie temporal de datos referente a la persona y el robot en orden cronológico "a menor tiempo, dato más antiguo". 
-2. Si al analizar la serie temporal detectas comportamientos que puedan hacer peligrar la misión, genera una respuesta hacia la persona que pueda evitarlo. La respuesta debe ser una indicación dirigida a la persona de lo que está ocurriendo.
-3. Si al analizar la serie temporal la misión progresa correctamente, genera una respuesta sin contenido. 
-4. La persona puede tener la intención de interactuar con elementos del entorno. Cuando detectes una posible interacción, la respuesta que elabores siempre debe contener algún comentario referente a los elementos. Por ejemplo, cuando detectes que la persona quiere cruzar una puerta, puedes indicar que la vas a cruzar también.
-5. Utiliza la información de tu velocidad como complemento para los avisos de peligro. Por ejemplo, si te estás moviendo y la persona se aleja puedes comentar "Estoy intentando avanzar hacia tí pero vas muy rápido. Camina más despacio por favor."
-6. Dispones del affordance que estás ejecutando en ese momento. Por ejemplo, si aparece un affordance 'aff_cross_0_4_0 door_0_4_0' significa que actualmente estás cruzando la puerta door_0_4_0 porque la persona tiene la intención de cruzarla.
-7. Dispones del nombre de la estancia en la que te encuentras actualmente. Si detectas un cambio de estancia, debes generar una respuesta respecto a ello hacia la persona. Por ejemplo, si a lo largo de la serie temporal detectas un cambio de room_0 a room_1 puedes indicar "Parece que estamos en la room_1"
-- Posibles casos:
-1. Si la orientación de la persona es "mirando al robot", puede significar que la persona quiere interactuar y por tanto, hay que generar una respuesta preguntando a la persona si necesita algo.
-2. Si las distancias a lo largo de la serie temporal crecen notablemente (sobre unos 0.3 metros entre muestras), o la distancia de los datos más recientes oscila los 3 metros, puede suponer que la persona salga del campo de visión de la persona. Por el contrario, si se acerca será más segura la navegación. Si la persona alcanza una distancia (aproximadamente 3 metros) que pueda dificultar la adquisición de los datos de posición, es conveniente avisarla para que reaccione y reduzca la velocidad.
-- Importante:
-1. Muy importante que el texto generado sea únicamente una frase en castellano para ser verbalizada en un TTS directamente. Imagina que eres una persona siguiendo a otra persona: si hay algún problema, haces un comentario. Si todo va bien, guardas silencio.
-2. Tu respuesta debe ser únicamente un diccionario con tres claves: "reasoning", donde almacenes tú pensamiento. "TTS", donde almacenas la frase a enviar al TTS. "time_next_inference", donde indicas un tiempo en segundos que vas a esperar para realizar otra inferencia. No generes nada de texto fuera de este diccionario. Un ejemplo de respuesta puede ser "{"reasoning": "", "TTS" : "", "time_next_inference" : 2}"
-3. Recuerda siempre que tú sigues a la persona, la persona no te sigue a tí. La persona nunca está detrás de tí
-4. Tus respuestas deben ser cortas y claras. Únicamente genera cuestiones cuando observes que la persona quiere interactuar contigo.  
-5. El tiempo en "time_next_inference" dependerá de la respuesta que hayas ofrecido anteriormente. Por ejemplo, si has avisado de que hay riesgo de perder a la persona, puedes incrementar el tiempo para esperar una reacción y evitar saturar a la persona con muchas respuestas. Si no has avisado, puedes disminuir el tiempo para monitorizar con un menor periodo. 
-6. Entre los mensajes se encuentra la respuesta al prompt anterior. Tenla en consideración cuando generes una nueva respuesta. Por ejemplo, si en la anterior respuesta has dicho que vas a cruzar la puerta, no es necesario que vuelvas a insistir.
-/no_think
-"""
-
-    messages = [{
-        "role": "system",
-        "content": main_prompt
-    }]
+    global messages, expended_times, last_answer, messages_memory, historial, estadisticas_ejecucion
+    client = envolver(obtener_pool(), cassette_mode, cassette_path, cassette_simulate_timing)
+
+
+    messages = [SYSTEM_MESSAGE]
+    messages_memory = crear_ventana()
+    historial = HistorialJSONL(ruta_historial(memory_limit, modelo_seleccionado))
+    activar_perfilado()
 
     expended_times = []
+    estadisticas_ejecucion = {"peticiones": 0, "reintentos": 0, "fallos_parseo": 0, "muestras_sin_respuesta": 0, "errores": 0, "tokens_generados": 0, "aciertos_cache": 0}
+    if mensajes_json and pipeline_mode:
+        # Se conserva la misma lista si ya lo es, para reutilizar su tabla codificada
+        return chat_pipeline(modelo_seleccionado, mensajes_json if isinstance(mensajes_json, list) else list(mensajes_json))
     if mensajes_json:
         print("📄 Ejecutando conversación desde JSON...\n")
-        for idx, msg in enumerate(mensajes_json):
-            data_dict = describe_state(msg)
-            if 'intention_targets' in msg:
-                sample_text = (
-                    f"- Tiempo {round(msg['time_mission_start'] - mensajes_json[0]['time_mission_start'], 2)}: "
-                    f"Shadow está {data_dict['robot_speed']}, "
-                    f"Shadow está en {data_dict['actual_room_name']}, "
-                    f"{'El affordance que Shadow está ejecutando actualmente es ' + ' '.join(msg['robot_submissions'][0]) if msg['robot_submissions'] else 'No estás ejecutando ningún affordance'}"
-                    f" La persona está a una distancia de {data_dict['frontal_distance']} y {data_dict['lateral_distance']}, "
-                    f"orientada {data_dict['orientation']}. "
-                    f"{'Es posible que la persona quiera interactuar con ' + ','.join(msg['intention_targets']) if msg['intention_targets'] else 'La persona no tiene intenciones de interacción'}"
-                )
+        # Una lista en memoria se renderiza entera de una vez; un iterador (iterar_muestras) se codifica
+        # muestra a muestra, con memoria constante sea cual sea la longitud de la grabación
+        if isinstance(mensajes_json, list):
+            with perfil.tramo("codificacion"):
+                lineas_completas, lineas_muestras = tabla_codificada(mensajes_json, sample_encoding)
+        codificador = CODIFICADORES[sample_encoding]
+        anterior = None
+        muestras, siguientes = itertools.tee(mensajes_json)
+        next(siguientes, None)
+        t0 = None
+        planificador = None
+        filtro = FiltroCambios(gate_distance_jump, gate_distance_limit, gate_heartbeat_seconds) if gate_mode != "off" else None
+        conversacion = ConversacionIncremental(multiturn_reset_turns) if prompt_layout == "multiturno" else None
+        controlador = ControladorVentana(window_min, window_max, latency_slo_p95) if adaptive_window else None
+        cache = CacheRespuestas(cache_size, cache_ttl, cache_distance_step, gate_distance_limit) if response_cache else None
+        mensajes_anteriores = None
+        for idx, (msg, siguiente) in enumerate(itertools.zip_longest(muestras, siguientes)):
+            if t0 is None:
+                t0 = msg['time_mission_start']
+                planificador = PlanificadorTiempoReal(t0, replay_speed) if realtime_replay else None
+            if planificador:
+                planificador.esperar_muestra(msg['time_mission_start'])
+            if isinstance(mensajes_json, list):
+                sample_text, linea_completa = lineas_muestras[idx], lineas_completas[idx]
             else:
-                sample_text = f"Tiempo={round(msg['time_mission_start'] - mensajes_json[0]['time_mission_start'], 2)}, distancia frontal={data_dict['frontal_distance']}, distancia lateral={data_dict['lateral_distance']}, orientación={data_dict['orientation']}"
+                with perfil.tramo("codificacion"):
+                    linea_completa, sample_text, anterior = codificador.codificar(msg, t0, anterior)
             # Añadimos la nueva muestra a la cola circular
-            messages_memory.append({"role": "user", "content": sample_text})
+            with perfil.tramo("ventana"):
+                messages_memory.agregar(sample_text, linea_completa, msg, idx)
 
-            # Construimos la serie temporal concatenando las muestras en orden
-            temporal_series = "\n".join([m["content"] for m in messages_memory])
+            if conversacion:
+                conversacion.agregar(sample_text)
 
-            # Creamos un solo prompt con la serie temporal completa
-            developer_prompt = f"""
-{temporal_series}
-                """
-            
-            # Agregamos a messages el prompt único con toda la ventana temporal
-            messages = [{"role": "system", "content": main_prompt}] + [{"role": "user", "content": developer_prompt}]
-            total_messages.append({"role": "system", "content": main_prompt})
-            total_messages.append({"role": "user", "content": developer_prompt})
-            # if last_answer != None:
-            #     messages += [last_answer]
-            #     total_messages.append({"role": "user", "content": developer_prompt})
+            with perfil.tramo("filtro"):
+                disparadores = filtro.evaluar(msg) if filtro else []
+            if gate_mode == "on" and not disparadores:
+                continue
 
-            try:
-                start = time.time()
-                if memory_limit > 0:
-                    if (idx % memory_sliding_window_size) == 0:
-                        print("Datos:", developer_prompt)
-                        completion = client.chat.completions.create(
-                            model=modelo_seleccionado,
-                            messages=messages,
-                            temperature=0.5,
-                        )
-                    else:
-                        continue
+            if planificador:
+                t_siguiente = siguiente['time_mission_start'] if siguiente else None
+                if not planificador.decidir(msg['time_mission_start'], t_siguiente):
+                    continue
+            elif memory_limit > 0 and (idx % memory_sliding_window_size) != 0:
+                continue
+
+            # Creamos el prompt con la serie temporal según la disposición elegida
+            with perfil.tramo("prompt"):
+                if conversacion:
+                    messages = conversacion.mensajes(messages_memory)
                 else:
-                    completion = client.chat.completions.create(
-                        model=modelo_seleccionado,
-                        messages=messages,
-                        temperature=0.5,
+                    messages = messages_memory.mensajes()
+            developer_prompt = messages[-1]["content"]
+            prefijo_comun = longitud_prefijo_comun(mensajes_anteriores, messages)
+            mensajes_anteriores = messages
+
+            # El prompt de sistema solo se escribe completo la primera vez; después, por hash
+            with perfil.tramo("historial"):
+                historial.agregar(SYSTEM_MESSAGE, idx=idx)
+                historial.agregar(messages[-1], idx=idx)
+            try:
+                print("Datos:", developer_prompt)
+                respuesta = None
+                with perfil.tramo("cache"):
+                    clave_cache = cache.clave(messages_memory.muestras_enviadas()) if cache else None
+                    reply = cache.obtener(clave_cache) if cache else None
+                if reply is not None:
+                    # Acierto de caché: misma ventana cuantizada, no se llama al modelo
+                    tiempos = {"total": 0.0, "ttft": None, "tts": None, "prompt_tokens": None, "completion_tokens": None,
+                               "cached_tokens": None, "prefijo_comun": prefijo_comun, "idx": idx,
+                               "ventana": min(messages_memory.capacidad, len(messages_memory)), "cache": True}
+                    expended_times.append(tiempos)
+                    estadisticas_ejecucion["aciertos_cache"] += 1
+                    historial.agregar({"role": "assistant", "content": reply}, idx=idx, cache=True)
+                    respuesta = RespuestaShadow.desde_texto(reply)
+                    print("🗃️ Respuesta reutilizada de la caché")
+                # En streaming el TTS se dice antes de validar: un reintento tras una respuesta cortada
+                # después del TTS no lo repite
+                tts_dicho = False
+                for intento in range(max_parse_retries + 1 if respuesta is None else 0):
+                    if intento > 0:
+                        estadisticas_ejecucion["reintentos"] += 1
+                    with perfil.tramo("peticion"):
+                        reply, tiempos = solicitar_respuesta(client, modelo_seleccionado, messages, hablar=not tts_dicho)
+                    tts_dicho = tts_dicho or (use_streaming and tiempos["tts"] is not None)
+                    # Dentro de la petición: hasta el primer token (prompt en el servidor + red) y generación.
+                    # Solo en streaming: sin él no hay primer token medido y el reparto sería falso
+                    if tiempos["ttft"] is not None:
+                        perfil.registrar("peticion.primer_token", tiempos["ttft"])
+                        perfil.registrar("peticion.generacion", tiempos["total"] - tiempos["ttft"])
+                    tiempos["prefijo_comun"] = prefijo_comun
+                    tiempos["idx"] = idx
+                    tiempos["ventana"] = min(messages_memory.capacidad, len(messages_memory))
+                    estadisticas_ejecucion["peticiones"] += 1
+                    estadisticas_ejecucion["tokens_generados"] += tiempos["completion_tokens"] or 0
+                    expended_times.append(tiempos)
+                    with perfil.tramo("historial"):
+                        historial.agregar({"role": "assistant", "content": reply}, idx=idx, intento=intento, LLM_expended_time=tiempos)
+                    print(
+                        f"⏱️ Total: {tiempos['total']:.2f}s | primer token: {tiempos['ttft'] or 0:.2f}s | TTS: {tiempos['tts'] or 0:.2f}s | "
+                        f"tokens: {tiempos['completion_tokens']} | prompt: {tiempos['prompt_tokens']} (caché: {tiempos['cached_tokens']}, prefijo común: {prefijo_comun} car.)"
                     )
-                expended_milliseconds = time.time() - start
-                expended_times.append(expended_milliseconds)
-                reply = completion.choices[0].message.content
-                match = re.search(r'\{[\s\S]*\}', reply, re.DOTALL)
-                if match:
-                    json_str = match.group()
-                    diccionario = json.loads(json_str)
-                    print(f"Razonamiento: {diccionario['reasoning']}")
-                    print(f"Respuesta TTS: {diccionario['TTS']}")
-                    print(f"Tiempo de espera para el siguiente análisis: {diccionario['time_next_inference']}\n")
+                    try:
+                        with perfil.tramo("parseo"):
+                            respuesta = RespuestaShadow.desde_texto(reply)
+                        # Solo se reutilizan los silencios: un aviso repetido para otra ventana sería incorrecto
+                        if cache and not respuesta.TTS:
+                            cache.guardar(clave_cache, reply)
+                        break
+                    except ValueError as e:
+                        estadisticas_ejecucion["fallos_parseo"] += 1
+                        print(f"⚠️ Respuesta no válida: {e}")
+                if filtro:
+                    filtro.registrar_llamada(msg['time_mission_start'])
+                if conversacion:
+                    conversacion.registrar_respuesta(reply)
+                if controlador and not tiempos.get("cache") and len(messages_memory) >= messages_memory.capacidad:
+                    nueva_capacidad = controlador.registrar(tiempos["total"], tiempos["prompt_tokens"], tiempos["ventana"])
+                    if nueva_capacidad:
+                        messages_memory.capacidad = nueva_capacidad
+                # Decisión del modelo para comparar configuraciones: hablar (TTS no vacío) o guardar silencio
+                tiempos["decision"] = bool(respuesta.TTS) if respuesta else None
+                if respuesta:
+                    print(f"Razonamiento: {respuesta.reasoning}")
+                    print(f"Respuesta TTS: {respuesta.TTS}")
+                    if not use_streaming:
+                        emitir_tts(respuesta.TTS)
+                    print(f"Tiempo de espera para el siguiente análisis: {respuesta.time_next_inference}\n")
                 else:
-                    print("No se encontró JSON en el texto.")
+                    estadisticas_ejecucion["muestras_sin_respuesta"] += 1
+                    print("No se obtuvo una respuesta válida; se continúa con la siguiente muestra.\n")
+                if filtro:
+                    filtro.registrar_respuesta(disparadores, respuesta.TTS if respuesta else None)
+                if planificador:
+                    planificador.registrar(msg['time_mission_start'], t_siguiente, respuesta.time_next_inference if respuesta else None)
                 # print(f"[{idx+1}/{len(mensajes_json)}] 🤖 Respuesta: {reply}\n")
-                # messages.append({"role": "assistant", "content": reply})
-                # total_messages.append({"role": "assistant", "content": reply})
                 last_answer = {"role": "assistant", "content": reply}
             except Exception as e:
+                # Todos los endpoints han fallado: se sigue con la siguiente muestra en lugar de abortar la misión
+                estadisticas_ejecucion["errores"] += 1
                 print("❌ Error al generar respuesta:", e)
-                break
+                continue
+        if planificador:
+            planificador.resumen()
+        if filtro:
+            filtro.resumen()
+        print(
+            f"📊 {estadisticas_ejecucion['peticiones']} peticiones, {estadisticas_ejecucion['reintentos']} reintentos, "
+            f"{estadisticas_ejecucion['fallos_parseo']} fallos de parseo, {estadisticas_ejecucion['muestras_sin_respuesta']} muestras sin respuesta, "
+            f"{estadisticas_ejecucion['errores']} errores, {estadisticas_ejecucion['tokens_generados']} tokens generados"
+        )
+        if cache:
+            cache.resumen()
+        if getattr(messages_memory, "descartadas_keyframe", 0):
+            print(f"🎞️ Ventana por tiempo: {messages_memory.descartadas_keyframe} muestras casi repetidas no enviadas")
+        if len(client.endpoints) > 1:
+            obtener_pool().resumen()
+        if cassette_mode != "directo":
+            client.resumen()
+            client.cerrar()
+        volcar_perfilado(modelo_seleccionado)
         guardar_historial()
     else:
         print("🤖 LLM Chat (escribe 'salir' para terminar)\n")
+        historial.agregar(SYSTEM_MESSAGE)
         while True:
             user_input = input("🧑 Tú: ")
             if user_input.lower() in {"salir", "exit", "quit"}:
@@ -254,6 +1002,7 @@ Eres Shadow, un robot social cuya misión es navegar siguiendo a personas. Debes
                 guardar_historial()
                 break
             messages.append({"role": "user", "content": user_input})
+            historial.agregar(messages[-1])
             try:
                 completion = client.chat.completions.create(
                     model=modelo_seleccionado,
@@ -263,10 +1012,347 @@ Eres Shadow, un robot social cuya misión es navegar siguiendo a personas. Debes
                 reply = completion.choices[0].message.content
                 print(f"🤖 Asistente: {reply}\n")
                 messages.append({"role": "assistant", "content": reply})
+                historial.agregar(messages[-1])
             except Exception as e:
                 print("❌ Error al generar respuesta:", e)
                 break
 
+async def _inferencia_pipeline(client, modelo_seleccionado, idx, t_muestra, messages, estado, reloj):
+    extractor = ExtractorJSONIncremental("TTS")
+    partes = []
+    stream = None
+    inicio = time.monotonic()
+    try:
+        stream = await client.chat.completions.create(
+            model=modelo_seleccionado,
+            messages=messages,
+            temperature=0.5,
+            stream=True,
+            **parametros_peticion(),
+        )
+        async for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            partes.append(chunk.choices[0].delta.content)
+            tts = extractor.alimentar(partes[-1])
+            if tts is None:
+                continue
+            edad = reloj() - t_muestra
+            if edad > max_tts_age:
+                estado["obsoletas"] += 1
+                print(f"🗑️ [{idx}] TTS descartado: datos con {edad:.2f}s de antigüedad")
+            else:
+                estado["latencias_tts"].append(edad)
+                if tts:
+                    estado["habladas"] += 1
+                emitir_tts(tts)
+    except asyncio.CancelledError:
+        # Las canceladas antes del primer token no llegaron a ocupar la generación del servidor
+        estado["canceladas" if partes else "canceladas_sin_token"] += 1
+        raise
+    except Exception as e:
+        estado["errores"] += 1
+        print(f"❌ [{idx}] Error al generar respuesta:", e)
+    finally:
+        if stream is not None:
+            await stream.close()
+        reply = "".join(partes)
+        if reply:
+            historial.agregar({"role": "assistant", "content": reply}, idx=idx,
+                             LLM_expended_time={"total": time.monotonic() - inicio})
+
+async def _pipeline_async(modelo_seleccionado, mensajes_json):
+    client = AsyncOpenAI(base_url=obtener_pool().elegir().url, api_key="lm-studio")
+    completas, incrementales = tabla_codificada(mensajes_json, sample_encoding)
+    filtro = FiltroCambios(gate_distance_jump, gate_distance_limit, gate_heartbeat_seconds) if gate_mode == "on" else None
+    t0 = mensajes_json[0]['time_mission_start']
+    inicio = time.monotonic()
+
+    def reloj():
+        return t0 + (time.monotonic() - inicio) * replay_speed
+
+    estado = {"lanzadas": 0, "canceladas": 0, "canceladas_sin_token": 0, "supersedidas": 0, "caducadas": 0,
+              "obsoletas": 0, "errores": 0, "habladas": 0, "latencias_tts": []}
+    # Una sola petición en curso: (idx, t_muestra, tarea); y como mucho una ventana esperando
+    en_curso = None
+    pendiente = None
+
+    def lanzar(idx, t_muestra, messages):
+        nonlocal en_curso
+        estado["lanzadas"] += 1
+        tarea = asyncio.create_task(_inferencia_pipeline(
+            client, modelo_seleccionado, idx, t_muestra, messages, estado, reloj
+        ))
+        en_curso = (idx, t_muestra, tarea)
+        tarea.add_done_callback(al_terminar)
+
+    def al_terminar(tarea):
+        nonlocal en_curso, pendiente
+        if en_curso is None or en_curso[2] is not tarea:
+            return
+        en_curso = None
+        if pendiente is not None:
+            idx, t_muestra, messages = pendiente
+            pendiente = None
+            if reloj() - t_muestra > max_tts_age:
+                # Ha esperado demasiado: su TTS ya no se diría
+                estado["caducadas"] += 1
+            else:
+                lanzar(idx, t_muestra, messages)
+
+    try:
+        for idx, msg in enumerate(mensajes_json):
+            espera = (msg['time_mission_start'] - reloj()) / replay_speed
+            if espera > 0:
+                await asyncio.sleep(espera)
+            messages_memory.agregar(incrementales[idx], completas[idx], msg, idx)
+            if filtro:
+                if not filtro.evaluar(msg):
+                    continue
+                filtro.registrar_llamada(msg['time_mission_start'])
+            messages = messages_memory.mensajes()
+            historial.agregar(SYSTEM_MESSAGE, idx=idx)
+            historial.agregar(messages[-1], idx=idx)
+            if en_curso is not None and cancel_superseded and reloj() - en_curso[1] > max_tts_age:
+                # La petición en curso ya no puede dar un TTS a tiempo: se cancela en favor de la nueva
+                tarea = en_curso[2]
+                en_curso = None
+                tarea.cancel()
+                if pendiente is not None:
+                    estado["supersedidas"] += 1
+                    pendiente = None
+            if en_curso is None:
+                lanzar(idx, msg['time_mission_start'], messages)
+            else:
+                if pendiente is not None:
+                    estado["supersedidas"] += 1
+                pendiente = (idx, msg['time_mission_start'], messages)
+        # Se espera a la petición en curso y a la última ventana pendiente
+        while en_curso is not None:
+            await asyncio.gather(en_curso[2], return_exceptions=True)
+            await asyncio.sleep(0)
+    finally:
+        if en_curso is not None:
+            en_curso[2].cancel()
+        await client.close()
+    return estado
+
+def chat_pipeline(modelo_seleccionado, mensajes_json):
+    """Inferencia online sobre el reloj del dataset: las muestras no esperan a la petición en curso, y al
+    terminar esta se envía la ventana más reciente."""
+    print(f"📄 Ejecutando en modo pipeline (x{replay_speed}, TTS con antigüedad máxima de {max_tts_age}s)...\n")
+    estado = asyncio.run(_pipeline_async(modelo_seleccionado, mensajes_json))
+    latencias = sorted(estado["latencias_tts"])
+    resumen = {
+        "lanzadas": estado["lanzadas"],
+        "canceladas": estado["canceladas"],
+        "canceladas_sin_token": estado["canceladas_sin_token"],
+        "descartadas_supersedidas": estado["supersedidas"],
+        "descartadas_caducadas": estado["caducadas"],
+        "descartadas_obsoletas": estado["obsoletas"],
+        "errores": estado["errores"],
+        "tts_entregados": len(latencias),
+        "tts_hablados": estado["habladas"],
+        "latencia_llegada_tts_media": sum(latencias) / len(latencias) if latencias else None,
+        "latencia_llegada_tts_max": latencias[-1] if latencias else None,
+    }
+    texto_latencia = (
+        f"{resumen['latencia_llegada_tts_media']:.2f}s de media (máx {resumen['latencia_llegada_tts_max']:.2f}s)"
+        if latencias else "n/d"
+    )
+    print(
+        f"\n🔁 Pipeline: {resumen['lanzadas']} peticiones, {resumen['canceladas']} canceladas generando, "
+        f"{resumen['canceladas_sin_token']} canceladas antes del primer token, "
+        f"{resumen['descartadas_supersedidas']} ventanas supersedidas en espera, "
+        f"{resumen['descartadas_caducadas']} caducadas en espera, {resumen['descartadas_obsoletas']} TTS obsoletos, "
+        f"{resumen['errores']} errores, {resumen['tts_entregados']} respuestas a tiempo ({resumen['tts_hablados']} TTS hablados). "
+        f"Llegada de muestra → TTS: {texto_latencia}"
+    )
+    guardar_historial()
+    return resumen
+
+def chat_en_vivo(modelo_seleccionado, cola):
+    """Consume muestras en vivo de la cola: añade a la ventana todas las pendientes y pregunta por la última."""
+    global expended_times, last_answer, messages_memory, historial, estadisticas_ejecucion
+    client = envolver(obtener_pool(), cassette_mode, cassette_path, cassette_simulate_timing)
+    messages_memory = crear_ventana()
+    historial = HistorialJSONL(ruta_historial(memory_limit, modelo_seleccionado))
+    expended_times = []
+    estadisticas_ejecucion = {"peticiones": 0, "reintentos": 0, "fallos_parseo": 0, "muestras_sin_respuesta": 0, "errores": 0, "tokens_generados": 0}
+    codificador = CODIFICADORES[sample_encoding]
+    activar_perfilado()
+    t0 = None
+    anterior = None
+    idx = 0
+    print(f"📡 Esperando muestras en vivo (cola de {cola.capacidad}, política '{cola.politica}')...\n")
+    try:
+        while True:
+            pendientes = cola.extraer_todas(timeout=1.0)
+            if pendientes is None:
+                break
+            if not pendientes:
+                continue
+            for llegada, msg in pendientes:
+                if t0 is None:
+                    t0 = msg['time_mission_start']
+                with perfil.tramo("codificacion"):
+                    completa, incremental, anterior = codificador.codificar(msg, t0, anterior)
+                with perfil.tramo("ventana"):
+                    messages_memory.agregar(incremental, completa, msg, idx)
+                idx += 1
+            with perfil.tramo("prompt"):
+                messages = messages_memory.mensajes()
+            historial.agregar(SYSTEM_MESSAGE, idx=idx - 1)
+            historial.agregar(messages[-1], idx=idx - 1)
+            espera_cola = time.monotonic() - llegada
+            perfil.registrar("espera_cola", espera_cola)
+            try:
+                respuesta = None
+                tts_dicho = False
+                for intento in range(max_parse_retries + 1):
+                    if intento > 0:
+                        estadisticas_ejecucion["reintentos"] += 1
+                    with perfil.tramo("peticion"):
+                        reply, tiempos = solicitar_respuesta(client, modelo_seleccionado, messages, hablar=not tts_dicho)
+                    tts_dicho = tts_dicho or (use_streaming and tiempos["tts"] is not None)
+                    tiempos.update(idx=idx - 1, espera_cola=espera_cola, lote=len(pendientes), profundidad=len(cola))
+                    estadisticas_ejecucion["peticiones"] += 1
+                    estadisticas_ejecucion["tokens_generados"] += tiempos["completion_tokens"] or 0
+                    expended_times.append(tiempos)
+                    historial.agregar({"role": "assistant", "content": reply}, idx=idx - 1, intento=intento, LLM_expended_time=tiempos)
+                    try:
+                        with perfil.tramo("parseo"):
+                            respuesta = RespuestaShadow.desde_texto(reply)
+                        break
+                    except ValueError as e:
+                        estadisticas_ejecucion["fallos_parseo"] += 1
+                        print(f"⚠️ Respuesta no válida: {e}")
+                print(
+                    f"⏱️ {len(pendientes)} muestras nuevas | en cola: {espera_cola:.2f}s | total: {tiempos['total']:.2f}s | "
+                    f"pendientes: {len(cola)} | descartadas: {cola.descartadas} | fusionadas: {cola.fusionadas}"
+                )
+                tiempos["decision"] = bool(respuesta.TTS) if respuesta else None
+                if respuesta:
+                    if not use_streaming:
+                        emitir_tts(respuesta.TTS)
+                else:
+                    estadisticas_ejecucion["muestras_sin_respuesta"] += 1
+                last_answer = {"role": "assistant", "content": reply}
+            except Exception as e:
+                estadisticas_ejecucion["errores"] += 1
+                print("❌ Error al generar respuesta:", e)
+    finally:
+        estadisticas_ejecucion["ingesta"] = cola.resumen()
+        print(
+            f"📊 {estadisticas_ejecucion['peticiones']} peticiones, {estadisticas_ejecucion['fallos_parseo']} fallos de parseo, "
+            f"{estadisticas_ejecucion['errores']} errores, {estadisticas_ejecucion['tokens_generados']} tokens generados"
+        )
+        if cassette_mode != "directo":
+            client.resumen()
+            client.cerrar()
+        volcar_perfilado(modelo_seleccionado)
+        guardar_historial()
+
+def construir_ventanas(mensajes_json):
+    """Construye de antemano todas las peticiones de una reproducción offline: lista de (idx, messages)."""
+    completas, incrementales = tabla_codificada(mensajes_json, sample_encoding)
+    ventana = crear_ventana()
+    filtro = FiltroCambios(gate_distance_jump, gate_distance_limit, gate_heartbeat_seconds) if gate_mode == "on" else None
+    ventanas = []
+    for idx, msg in enumerate(mensajes_json):
+        ventana.agregar(incrementales[idx], completas[idx], msg, idx)
+        if filtro:
+            if not filtro.evaluar(msg):
+                continue
+            filtro.registrar_llamada(msg['time_mission_start'])
+        if memory_limit > 0 and (idx % memory_sliding_window_size) != 0:
+            continue
+        ventanas.append((idx, ventana.mensajes()))
+    return ventanas
+
+async def _solicitar_async(client, semaforo, modelo_seleccionado, idx, messages):
+    async with semaforo:
+        resultado = {"idx": idx, "reply": None, "respuesta": None, "intentos": 0, "error": None}
+        for intento in range(max_parse_retries + 1):
+            start = time.monotonic()
+            try:
+                completion = await client.chat.completions.create(
+                    model=modelo_seleccionado,
+                    messages=messages,
+                    temperature=0.5,
+                    **parametros_peticion(),
+                )
+            except Exception as e:
+                resultado["error"] = str(e)
+                break
+            resultado["total"] = time.monotonic() - start
+            # Reloj monotónico, para cruzar la petición con el muestreo de recursos
+            resultado["inicio"] = start
+            resultado["intentos"] = intento + 1
+            resultado["reply"] = completion.choices[0].message.content
+            usage = completion.usage
+            resultado["prompt_tokens"] = usage.prompt_tokens if usage else None
+            resultado["completion_tokens"] = usage.completion_tokens if usage else None
+            try:
+                resultado["respuesta"] = RespuestaShadow.desde_texto(resultado["reply"])
+                break
+            except ValueError:
+                continue
+        resultado["decision"] = bool(resultado["respuesta"].TTS) if resultado["respuesta"] else None
+        return resultado
+
+async def _evaluar_async(modelo_seleccionado, ventanas, concurrencia):
+    client = AsyncOpenAI(base_url=obtener_pool().elegir().url, api_key="lm-studio")
+    semaforo = asyncio.Semaphore(concurrencia)
+    try:
+        # gather devuelve los resultados en el mismo orden que las ventanas
+        return await asyncio.gather(*(
+            _solicitar_async(client, semaforo, modelo_seleccionado, idx, messages) for idx, messages in ventanas
+        ))
+    finally:
+        await client.close()
+
+def evaluar_offline_concurrente(modelo_seleccionado, mensajes_json, concurrencia=4):
+    """Reproducción offline: como cada petición solo depende de su ventana, se envían todas con
+    'concurrencia' peticiones en vuelo como máximo. Devuelve los resultados en orden y el resumen."""
+    global historial
+    ventanas = construir_ventanas(mensajes_json)
+    print(f"📄 Evaluación offline de {len(ventanas)} ventanas con {concurrencia} peticiones simultáneas...\n")
+    inicio = time.monotonic()
+    resultados = asyncio.run(_evaluar_async(modelo_seleccionado, ventanas, concurrencia))
+    duracion = time.monotonic() - inicio
+
+    historial = HistorialJSONL(ruta_historial(memory_limit, modelo_seleccionado))
+    for (idx, messages), resultado in zip(ventanas, resultados):
+        historial.agregar(SYSTEM_MESSAGE, idx=idx)
+        historial.agregar(messages[-1], idx=idx)
+        if resultado["reply"] is not None:
+            historial.agregar({"role": "assistant", "content": resultado["reply"]}, idx=idx,
+                             LLM_expended_time={"total": resultado.get("total")})
+        respuesta = resultado["respuesta"]
+        estado = f"TTS: {respuesta.TTS!r}" if respuesta else f"❌ {resultado['error'] or 'respuesta no válida'}"
+        print(f"[{idx}] {resultado.get('total') or 0:.2f}s {estado}")
+    guardar_historial()
+
+    completadas = [r for r in resultados if r["reply"] is not None]
+    tokens = sum(r.get("completion_tokens") or 0 for r in completadas)
+    resumen = {
+        "peticiones": len(resultados),
+        "completadas": len(completadas),
+        "fallidas": len(resultados) - len(completadas),
+        "sin_respuesta_valida": sum(r["respuesta"] is None for r in resultados),
+        "duracion": duracion,
+        "peticiones_s": len(completadas) / duracion if duracion else 0.0,
+        "tokens_s": tokens / duracion if duracion else 0.0,
+        "latencia_media": sum(r["total"] for r in completadas) / len(completadas) if completadas else 0.0,
+    }
+    print(
+        f"\n⚡ {resumen['completadas']}/{resumen['peticiones']} peticiones en {duracion:.2f}s: "
+        f"{resumen['peticiones_s']:.2f} peticiones/s, {resumen['tokens_s']:.1f} tokens/s generados, "
+        f"latencia media {resumen['latencia_media']:.2f}s"
+    )
+    return resultados, resumen
+
 def describe_state(state: dict) -> dict:
     result = copy.copy(state)
 
@@ -315,10 +1401,289 @@ def describe_state(state: dict) -> dict:
 
     return result
 
+def construir_texto_muestra(msg, data_dict, t0):
+    if 'intention_targets' in msg:
+        return (
+            f"- Tiempo {round(msg['time_mission_start'] - t0, 2)}: "
+            f"Shadow está {data_dict['robot_speed']}, "
+            f"Shadow está en {data_dict['actual_room_name']}, "
+            f"{'El affordance que Shadow está ejecutando actualmente es ' + ' '.join(msg['robot_submissions'][0]) if msg['robot_submissions'] else 'No estás ejecutando ningún affordance'}"
+            f" La persona está a una distancia de {data_dict['frontal_distance']} y {data_dict['lateral_distance']}, "
+            f"orientada {data_dict['orientation']}. "
+            f"{'Es posible que la persona quiera interactuar con ' + ','.join(msg['intention_targets']) if msg['intention_targets'] else 'La persona no tiene intenciones de interacción'}"
+        )
+    return f"Tiempo={round(msg['time_mission_start'] - t0, 2)}, distancia frontal={data_dict['frontal_distance']}, distancia lateral={data_dict['lateral_distance']}, orientación={data_dict['orientation']}"
+
+def _es_vectorizable(state):
+    distancia = state.get("distance")
+    velocidad = state.get("robot_speed")
+    return (
+        isinstance(distancia, (list, tuple)) and len(distancia) == 2 and distancia[0] != 0 and distancia[1] != 0
+        and isinstance(velocidad, (list, tuple)) and len(velocidad) == 2
+        and isinstance(state.get("orientation"), (int, float))
+    )
+
+def _describir_columnas(states):
+    """Calcula con NumPy, en una sola pasada, los textos de distancia, orientación y velocidad.
+    Devuelve un diccionario con esos campos por muestra, o None si la muestra requiere el camino escalar."""
+    descripciones = [None] * len(states)
+    indices = [i for i, state in enumerate(states) if _es_vectorizable(state)]
+    if not indices:
+        return descripciones
+
+    distancias = np.array([states[i]["distance"] for i in indices], dtype=float)
+    velocidades = np.array([states[i]["robot_speed"] for i in indices], dtype=float)
+    angulos = (np.array([states[i]["orientation"] for i in indices], dtype=float) + math.pi) % (2 * math.pi) - math.pi
+
+    x, y = distancias[:, 0], distancias[:, 1]
+    abs_angulos = np.abs(angulos)
+    clase_orientacion = np.select(
+        [abs_angulos < math.pi / 6, abs_angulos > 5 * math.pi / 6, angulos > 0],
+        [0, 1, 2],
+        default=3,
+    )
+    lin, ang = velocidades[:, 0], velocidades[:, 1]
+    mueve_lin = np.abs(lin) >= 0.05
+    mueve_ang = np.abs(ang) >= 0.05
+
+    # El formateo de texto se hace sobre floats de Python para reproducir exactamente describe_state
+    columnas = zip(
+        indices,
+        np.abs(x).tolist(), (x < 0).tolist(), np.abs(y).tolist(), (y < 0).tolist(),
+        angulos.tolist(), clase_orientacion.tolist(),
+        np.abs(lin).tolist(), mueve_lin.tolist(), (lin > 0).tolist(),
+        np.abs(ang).tolist(), mueve_ang.tolist(), (ang > 0).tolist(),
+    )
+    for i, ax, x_neg, ay, y_neg, angulo, clase, alin, mlin, lin_pos, aang, mang, ang_pos in columnas:
+        if clase == 0:
+            orientacion = "en el mismo sentido que el robot"
+        elif clase == 1:
+            orientacion = "mirando al robot"
+        elif clase == 2:
+            orientacion = f"hacia la izquierda {round(angulo,1)} radianes"
+        else:
+            orientacion = f"hacia la derecha {round(angulo,1)} radianes"
+        if not mlin and not mang:
+            velocidad = "detenido"
+        else:
+            desc = []
+            if mlin:
+                desc.append(f"moviéndose {'hacia delante' if lin_pos else 'hacia atrás'} a {alin:.2f} m/s")
+            if mang:
+                desc.append(f"rotando hacia la {'izquierda' if ang_pos else 'derecha'} a {aang:.2f} rad/s")
+            velocidad = ", ".join(desc)
+        descripciones[i] = {
+            "lateral_distance": f"{ax:.2f} metros {'izquierda' if x_neg else 'derecha'}",
+            "frontal_distance": f"{ay:.2f} metros {'detrás' if y_neg else 'delante'} del robot",
+            "orientation": orientacion,
+            "robot_speed": velocidad,
+        }
+    return descripciones
+
+def describe_states(states: list) -> list:
+    """Versión por lotes de describe_state: mismo resultado, calculado con NumPy en una sola pasada."""
+    if np is None:
+        return [describe_state(state) for state in states]
+    resultados = []
+    for state, desc in zip(states, _describir_columnas(states)):
+        if desc is None:
+            # Casos incompletos o con ejes a cero: se mantiene el camino escalar
+            resultados.append(describe_state(state))
+        else:
+            result = copy.copy(state)
+            result.update(desc)
+            resultados.append(result)
+    return resultados
+
+# Tabla de líneas ya renderizadas del último dataset, reutilizable entre ejecuciones sobre la misma lista
+# de muestras (el benchmark carga cada dataset una vez). Solo se guarda una para no retener datasets viejos.
+_tabla_muestras = None
+
+def tabla_muestras(mensajes_json):
+    """Renderiza una vez todas las líneas de muestra de un dataset y las guarda para reutilizarlas."""
+    global _tabla_muestras
+    cache = _tabla_muestras
+    if cache is not None and cache[0] is mensajes_json and len(cache[1]) == len(mensajes_json):
+        return cache[1]
+    t0 = mensajes_json[0]['time_mission_start']
+    descripciones = _describir_columnas(mensajes_json) if np is not None else [None] * len(mensajes_json)
+    lineas = []
+    for msg, desc in zip(mensajes_json, descripciones):
+        if desc is None:
+            data_dict = describe_state(msg)
+        else:
+            # Solo hacen falta los campos que usa el texto, sin copiar la muestra entera
+            desc["actual_room_name"] = msg.get("actual_room_name")
+            data_dict = desc
+        lineas.append(construir_texto_muestra(msg, data_dict, t0))
+    _tabla_muestras = (mensajes_json, lineas)
+    return lineas
+
+def _orientacion_compacta(angulo):
+    angulo = (angulo + math.pi) % (2 * math.pi) - math.pi
+    if abs(angulo) < math.pi / 6:
+        return "mismo sentido"
+    if abs(angulo) > 5 * math.pi / 6:
+        return "mirando al robot"
+    return f"{'izq' if angulo > 0 else 'der'} {round(angulo,1)}"
+
+# Codificación por defecto: las frases en castellano de tabla_muestras
+class CodificadorVerboso:
+    cabecera = None
+
+    def lineas(self, mensajes_json):
+        lineas = tabla_muestras(mensajes_json)
+        return lineas, lineas
+
+    def codificar(self, msg, t0, anterior=None):
+        """Una sola muestra (ingesta en vivo): (línea completa, línea incremental, estado para la siguiente)."""
+        linea = construir_texto_muestra(msg, describe_state(msg), t0)
+        return linea, linea, None
+
+# Codificación tabular: una fila por muestra con columnas separadas por ';'
+class CodificadorTabla:
+    def __init__(self, delta=False):
+        self.delta = delta
+        self.cabecera = (
+            "Columnas: t(s); v_lineal(m/s); v_angular(rad/s); estancia; affordance; "
+            "d_frontal(m, + delante); d_lateral(m, + derecha); orientación de la persona; intenciones"
+        )
+        if delta:
+            self.cabecera += (
+                ". '=' indica igual que la fila anterior y 'Δ' la variación de distancia respecto a la fila anterior"
+            )
+
+    def lineas(self, mensajes_json):
+        t0 = mensajes_json[0]['time_mission_start']
+        completas = []
+        incrementales = []
+        anterior = None
+        for msg in mensajes_json:
+            completa, incremental, anterior = self.codificar(msg, t0, anterior)
+            completas.append(completa)
+            incrementales.append(incremental)
+        return completas, incrementales
+
+    def codificar(self, msg, t0, anterior=None):
+        """Una sola muestra: (línea completa, línea incremental, estado para la siguiente)."""
+        lin, ang = msg.get("robot_speed", (0.0, 0.0))
+        x, y = msg.get("distance", (0.0, 0.0))
+        campos = {
+            "t": f"{round(msg['time_mission_start'] - t0, 2)}",
+            "v": f"{lin:.2f}; {ang:.2f}",
+            "estancia": msg.get("actual_room_name") or "-",
+            "affordance": " ".join(msg["robot_submissions"][0]) if msg.get("robot_submissions") else "-",
+            "frontal": f"{y:.2f}",
+            "lateral": f"{x:.2f}",
+            "orientacion": _orientacion_compacta(msg.get("orientation", 0.0)),
+            "intenciones": ",".join(msg.get("intention_targets") or []) or "-",
+        }
+        completa = "; ".join(campos.values())
+        if not self.delta or anterior is None:
+            incremental = completa
+        else:
+            xa, ya, campos_anteriores = anterior
+            cambios = dict(campos)
+            for clave in ("estancia", "affordance", "intenciones"):
+                if campos[clave] == campos_anteriores[clave]:
+                    cambios[clave] = "="
+            cambios["frontal"] = f"Δ{y - ya:+.2f}"
+            cambios["lateral"] = f"Δ{x - xa:+.2f}"
+            incremental = "; ".join(cambios.values())
+        return completa, incremental, (x, y, campos)
+
+CODIFICADORES = {
+    "verboso": CodificadorVerboso(),
+    "csv": CodificadorTabla(),
+    "delta": CodificadorTabla(delta=True),
+}
+
+# Por codificación, la tabla del último dataset: (lista de muestras, (completas, incrementales))
+_tablas_codificadas = {}
+
+def tabla_codificada(mensajes_json, codificacion="verboso"):
+    """Líneas completas e incrementales de un dataset para la codificación dada, cacheadas como tabla_muestras."""
+    clave = codificacion
+    cache = _tablas_codificadas.get(clave)
+    if cache is not None and cache[0] is mensajes_json and len(cache[1][0]) == len(mensajes_json):
+        return cache[1]
+    resultado = CODIFICADORES[codificacion].lineas(mensajes_json)
+    _tablas_codificadas[clave] = (mensajes_json, resultado)
+    return resultado
+
+def benchmark_ventana(mensajes_json, pasos=20000, maxlen=None):
+    """Compara el coste por paso de la construcción original del prompt con VentanaTemporal."""
+    import timeit
+    maxlen = memory_limit if maxlen is None else maxlen
+    lineas = tabla_muestras(mensajes_json)
+
+    def original():
+        memoria = deque(maxlen=maxlen)
+        historial = []
+        for i in range(pasos):
+            memoria.append({"role": "user", "content": lineas[i % len(lineas)]})
+            temporal_series = "\n".join([m["content"] for m in memoria])
+            developer_prompt = f"""
+{temporal_series}
+                """
+            mensajes = [{"role": "system", "content": MAIN_PROMPT}] + [{"role": "user", "content": developer_prompt}]
+            historial.append({"role": "system", "content": MAIN_PROMPT})
+            historial.append({"role": "user", "content": developer_prompt})
+        return mensajes
+
+    def incremental():
+        ventana = VentanaTemporal(maxlen)
+        historial = []
+        for i in range(pasos):
+            ventana.agregar(lineas[i % len(lineas)])
+            mensajes = ventana.mensajes()
+            historial.append(SYSTEM_MESSAGE)
+            historial.append(mensajes[1])
+        return mensajes
+
+    assert original() == incremental()
+    t_original = min(timeit.repeat(original, number=1, repeat=3)) / pasos
+    t_incremental = min(timeit.repeat(incremental, number=1, repeat=3)) / pasos
+    print(f"🧪 Ventana de {maxlen} muestras, {pasos} pasos:")
+    print(f"   original:    {t_original * 1e6:.2f} µs/paso")
+    print(f"   incremental: {t_incremental * 1e6:.2f} µs/paso ({t_original / t_incremental:.1f}x)")
+    return t_original, t_incremental
+
+if __name__ == "__main__" and "--concurrencia" in sys.argv:
+    # Evaluación offline concurrente: python LLM_local_test_temporal_series.py --concurrencia 4
+    concurrencia = int(sys.argv[sys.argv.index("--concurrencia") + 1])
+    if esperar_api():
+        ruta_json = seleccionar_json()
+        if ruta_json:
+            evaluar_offline_concurrente(model_name, cargar_json(ruta_json), concurrencia)
+    sys.exit(0)
+
+if __name__ == "__main__" and "--en-vivo" in sys.argv:
+    # Ingesta en vivo: python LLM_local_test_temporal_series.py --en-vivo [tcp://127.0.0.1:5555 | tubería | -]
+    # Para probar sin robot: python LLM_local_ingesta.py dataset/<fichero>.json --velocidad 2
+    posicion = sys.argv.index("--en-vivo") + 1
+    fuente = sys.argv[posicion] if posicion < len(sys.argv) else live_ingest_source
+    if esperar_api():
+        cola = ColaMuestras(ingest_queue_size, ingest_policy)
+        abrir_fuente(fuente, cola)
+        try:
+            chat_en_vivo(model_name, cola)
+        except KeyboardInterrupt:
+            cola.cerrar()
+    sys.exit(0)
+
+if __name__ == "__main__" and "--bench-ventana" in sys.argv:
+    ruta_json = seleccionar_json()
+    if ruta_json:
+        benchmark_ventana(cargar_json(ruta_json))
+    sys.exit(0)
+
 if __name__ == "__main__":
     if esperar_api():
         ruta_json = seleccionar_json()
-        mensajes_json = cargar_json(ruta_json) if ruta_json else None
+        # --desde T: empieza en el instante T (segundos de time_mission_start) usando el índice lateral
+        desde = float(sys.argv[sys.argv.index("--desde") + 1]) if "--desde" in sys.argv else None
+        mensajes_json = iterar_muestras(ruta_json, desde) if ruta_json else None
         # modelo_cargado = obtener_modelo_lanzado_lmstudio()
         # model_name = modelo_cargado
         if model_name is not None: